@@ -0,0 +1,98 @@
+"""
+Size and CPU tradeoff of message compression on analytics like payloads.
+
+    python benchmarks/bench_compression.py
+    python benchmarks/bench_compression.py --events 10 100 1000 --levels 1 6 9
+
+`wire` is the size sent to the broker, the HTTP sender sends compressed bodies as base64,
+so its request is a third larger than the stored message.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yodo1.rabbitmq import Compressor, RabbitHttpSender, decompress  # noqa: E402
+from yodo1.rabbitmq.compression import CODECS  # noqa: E402
+
+DEFAULT_LEVELS: Dict[str, List[Optional[int]]] = {
+    "deflate": [1, 6, 9],
+    "zstd": [1, 3, 9],
+    "lz4": [0, 9],
+}
+
+
+def make_payload(events: int) -> Dict[str, Any]:
+    rand = random.Random(events)
+    return {
+        "app_key": "yodo1-demo-game",
+        "sdk_version": "6.1.2",
+        "events": [
+            {
+                "event": rand.choice(["level-start", "level-complete", "ad-show", "ad-click", "purchase"]),
+                "user_id": f"user-{rand.randint(1, 5000):06d}",
+                "device": {"os": rand.choice(["android", "ios"]), "model": rand.choice(["SM-G991B", "iPhone14,2"])},
+                "level": rand.randint(1, 300),
+                "ts": 1700000000 + rand.randint(0, 86400),
+                "duration": round(rand.random() * 120, 3),
+            }
+            for _ in range(events)
+        ],
+    }
+
+
+def best_us(func: Callable[[], Any], repeat: int) -> float:
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - start > 0.05:
+            break
+        number *= 4
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best * 1e6
+
+
+def run(events: List[int], levels: Optional[List[int]], repeat: int) -> None:
+    print(f"available encodings: {', '.join(sorted(CODECS))}")
+    print(f"{'events':>6} {'codec':<12} {'body':>9} {'stored':>9} {'wire':>9} {'ratio':>6} "
+          f"{'compress':>10} {'decompress':>11} {'build msg':>10}")
+    for count in events:
+        payload = make_payload(count)
+        body = json.dumps(payload).encode()
+        build_plain = best_us(lambda: RabbitHttpSender._build_message_json(message_body=payload), repeat)
+        print(f"{count:>6} {'none':<12} {len(body):>9,} {len(body):>9,} {len(body):>9,} {1:>6.2f} "
+              f"{'':>10} {'':>11} {build_plain:>8.1f}us")
+        for encoding in sorted(CODECS):
+            for level in (levels or DEFAULT_LEVELS.get(encoding, [None])):
+                compressor = Compressor(encoding, threshold=0, level=level)
+                compressed, content_encoding = compressor.compress(body)
+                message = RabbitHttpSender._build_message_json(message_body=payload, compressor=compressor)
+                compress_us = best_us(lambda: compressor.compress(body), repeat)
+                decompress_us = best_us(lambda: decompress(compressed, content_encoding), repeat)
+                build_us = best_us(
+                    lambda: RabbitHttpSender._build_message_json(message_body=payload, compressor=compressor), repeat)
+                name = f"{encoding}:{level}"
+                print(f"{count:>6} {name:<12} {len(body):>9,} {len(compressed):>9,} {len(message['payload']):>9,} "
+                      f"{len(body) / len(compressed):>6.2f} {compress_us:>8.1f}us {decompress_us:>9.1f}us "
+                      f"{build_us:>8.1f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--levels", type=int, nargs="+", default=None, help="override the levels of every codec")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(events=args.events, levels=args.levels, repeat=args.repeat)
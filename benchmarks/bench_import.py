@@ -0,0 +1,55 @@
+"""
+Measure import time of each `yodo1` submodule in a fresh interpreter.
+
+    python benchmarks/bench_import.py --repeat 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES: List[str] = [
+    "yodo1",
+    "yodo1.cache",
+    "yodo1.logger",
+    "yodo1.progress",
+    "yodo1.uvicorn",
+    "yodo1.pydantic",
+    "yodo1.sqlalchemy",
+    "yodo1.fastapi",
+    "yodo1.sso",
+    "yodo1.aio_pika",
+    "yodo1.rabbitmq",
+]
+
+
+def import_time(module: str) -> float:
+    """
+    Total import time in ms reported by `python -X importtime`, includes the dependencies.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            env=dict(os.environ, PYTHONPATH=ROOT),
+                            check=True)
+    # The last line is the module itself, cumulative time covers every nested import
+    last_line = result.stderr.decode().strip().splitlines()[-1]
+    cumulative_us = int(last_line.split("|")[1])
+    return cumulative_us / 1000
+
+
+def run(repeat: int) -> None:
+    print(f"{'module':<20} {'import ms':>10}")
+    for module in MODULES:
+        best = min(import_time(module) for _ in range(repeat))
+        print(f"{module:<20} {best:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(repeat=args.repeat)
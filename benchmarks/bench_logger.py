@@ -0,0 +1,62 @@
+"""
+Compare formatting throughput of the colored formatters and the JSON formatter,
+and the cost of SamplingFilter per record.
+
+    python benchmarks/bench_logger.py --records 100000
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yodo1 import logger as yodo1_logger  # noqa: E402
+from yodo1.logger import JSONFormatter, SamplingFilter, get_color_formatter  # noqa: E402
+
+
+def throughput(formatter: logging.Formatter, records: int) -> float:
+    record = logging.LogRecord("yodo1.rabbitmq", logging.INFO, __file__, 10,
+                               "Ack message on Queue<%s> with delivery_tag: %s", ("demo.queue", 42), None)
+    record.elasticapm_trace_id = "0af7651916cd43dd8448eb211c80319c"
+    record.elasticapm_transaction_id = "b7ad6b7169203331"
+    start = time.perf_counter()
+    for _ in range(records):
+        formatter.format(record)
+    return records / (time.perf_counter() - start)
+
+
+def run(records: int) -> None:
+    print(f"{'colored simple':<20} {throughput(get_color_formatter('simple'), records):>12,.0f} records/s")
+    print(f"{'colored full':<20} {throughput(get_color_formatter('full'), records):>12,.0f} records/s")
+    print(f"{'json (orjson)':<20} {throughput(JSONFormatter(), records):>12,.0f} records/s")
+    with mock.patch.object(yodo1_logger, "orjson", None):
+        print(f"{'json (stdlib)':<20} {throughput(JSONFormatter(), records):>12,.0f} records/s")
+
+    # Common approach, copy record.__dict__ and dump it
+    class DictCopyFormatter(logging.Formatter):
+        def format(self, record: logging.LogRecord) -> str:
+            data = dict(record.__dict__)
+            data["message"] = record.getMessage()
+            return json.dumps(data, default=str)
+
+    print(f"{'json (__dict__ copy)':<20} {throughput(DictCopyFormatter(), records):>12,.0f} records/s")
+
+    record = logging.LogRecord("yodo1.rabbitmq", logging.DEBUG, __file__, 10, "message", None, None)
+    for name, sampling in [("every_n=100", SamplingFilter(every_n=100)),
+                           ("per_second=10", SamplingFilter(per_second=10))]:
+        start = time.perf_counter()
+        for _ in range(records):
+            sampling.filter(record)
+        cost = (time.perf_counter() - start) / records * 1e9
+        print(f"{'filter ' + name:<20} {cost:>12,.0f} ns/record")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=100000)
+    args = parser.parse_args()
+    run(records=args.records)
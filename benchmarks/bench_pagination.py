@@ -0,0 +1,91 @@
+"""
+Compare offset paging with keyset paging on a large SQLite table.
+
+    python benchmarks/bench_pagination.py --rows 200000 --page-size 50
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import INTEGER, TEXT, Column, Index, create_engine  # noqa: E402
+
+from yodo1.sqlalchemy import BaseDBModel, DBManager, encode_cursor  # noqa: E402
+
+
+class BenchPageItem(BaseDBModel):
+    __tablename__ = "bench_page_item"
+    __table_args__ = (Index("ix_bench_page_item_created_at_id", "created_at", "id"), {"extend_existing": True})
+
+    id = Column(INTEGER, primary_key=True, autoincrement=True, nullable=False)
+    title = Column(TEXT, nullable=False)
+
+
+def seed(db: DBManager, rows: int) -> None:
+    BenchPageItem.__table__.create(bind=db.engine)
+    start = datetime.datetime(2020, 1, 1)
+    batch = []
+    for i in range(rows):
+        created_at = start + datetime.timedelta(seconds=i // 3)
+        batch.append({"title": f"item {i}", "created_at": created_at, "updated_at": created_at})
+        if len(batch) == 10000:
+            with db.engine.begin() as conn:
+                conn.execute(BenchPageItem.__table__.insert(), batch)
+            batch = []
+    if batch:
+        with db.engine.begin() as conn:
+            conn.execute(BenchPageItem.__table__.insert(), batch)
+
+
+def timed(func: Callable[[], None], repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(rows: int, page_size: int) -> None:
+    with tempfile.TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'bench.sqlite')}")
+        db = DBManager(engine=engine)
+        seed(db, rows)
+
+        session = db.session()
+        depths: List[int] = [0, rows // 100, rows // 10, rows // 2, rows - page_size * 2]
+
+        print(f"{'page start':>12} | {'offset ms':>10} | {'keyset ms':>10}")
+        for depth in depths:
+            # Cursor of the row right before the target page, like a client walking through pages
+            cursor = None
+            if depth > 0:
+                last = (session.query(BenchPageItem)
+                        .order_by(BenchPageItem.created_at, BenchPageItem.id)
+                        .offset(depth - 1).limit(1).one())
+                cursor = encode_cursor(("created_at", "id"), [last.created_at, last.id])
+
+            def offset_page() -> None:
+                (session.query(BenchPageItem)
+                 .order_by(BenchPageItem.created_at, BenchPageItem.id)
+                 .offset(depth).limit(page_size).all())
+
+            def keyset_page() -> None:
+                BenchPageItem.paginate(session, limit=page_size, cursor=cursor)
+
+            print(f"{depth:>12} | {timed(offset_page):>10.2f} | {timed(keyset_page):>10.2f}")
+        session.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--page-size", type=int, default=50)
+    args = parser.parse_args()
+    run(rows=args.rows, page_size=args.page_size)
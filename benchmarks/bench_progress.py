@@ -0,0 +1,55 @@
+"""
+Cost per ProgressBar.update() call for very large iterations.
+
+    python benchmarks/bench_progress.py --items 1000000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yodo1.progress import ProgressBar  # noqa: E402
+
+
+class ModuloProgressBar(ProgressBar):
+    """
+    The previous implementation, modulo check on every update.
+    """
+    def update(self, n: int = 1) -> None:
+        if self.index == 0:
+            self._start_at = time.time()
+        self.index += n
+        if self.total == 0:
+            return
+        if int(self.index) % self.step == 0 or self.index == self.total:
+            self._log()
+
+
+def cost(bar: ProgressBar, items: int) -> float:
+    start = time.perf_counter()
+    for _ in range(items):
+        bar.update()
+    return (time.perf_counter() - start) / items * 1e9
+
+
+def run(items: int) -> None:
+    logging.basicConfig(level=logging.WARNING)
+    cases = [
+        ("modulo step=1000", ModuloProgressBar(total=items, desc="bench", step=1000)),
+        ("step=1000", ProgressBar(total=items, desc="bench", step=1000)),
+        ("min_interval=10", ProgressBar(total=items, desc="bench", min_interval=10)),
+        ("step=1000 thread_safe", ProgressBar(total=items, desc="bench", step=1000, thread_safe=True)),
+        ("shared step=1000", ProgressBar.shared(total=items, desc="bench", step=1000)),
+    ]
+    for name, bar in cases:
+        print(f"{name:<24} {cost(bar, items):>8,.0f} ns/update")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=1000000)
+    args = parser.parse_args()
+    run(items=args.items)
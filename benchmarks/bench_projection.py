@@ -0,0 +1,82 @@
+"""
+Compare `query().all()` + `to_dict` with the Core projection `BaseDBModel.project`.
+
+    python benchmarks/bench_projection.py --rows 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import INTEGER, TEXT, Column, create_engine  # noqa: E402
+
+from yodo1.sqlalchemy import BaseDBModel, DBManager  # noqa: E402
+
+
+class BenchProjectItem(BaseDBModel):
+    __tablename__ = "bench_project_item"
+    __table_args__ = {"extend_existing": True}
+
+    id = Column(INTEGER, primary_key=True, autoincrement=True, nullable=False)
+    title = Column(TEXT, nullable=False)
+    description = Column(TEXT, nullable=False)
+
+
+def timed(func: Callable[[], None], repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(rows: int) -> None:
+    with tempfile.TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'bench.sqlite')}")
+        db = DBManager(engine=engine)
+        BenchProjectItem.__table__.create(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(BenchProjectItem.__table__.insert(), [
+                {"title": f"item {i}", "description": "x" * 200,
+                 "created_at": BaseDBModel.time_now(), "updated_at": BaseDBModel.time_now()}
+                for i in range(rows)
+            ])
+
+        def orm_to_dict() -> None:
+            session = db.session()
+            [item.to_dict(["id", "title"]) for item in session.query(BenchProjectItem).all()]
+            session.close()
+
+        def orm_to_dict_all_columns() -> None:
+            session = db.session()
+            [item.to_dict() for item in session.query(BenchProjectItem).all()]
+            session.close()
+
+        def project_dict() -> None:
+            session = db.session()
+            BenchProjectItem.project(session, ["id", "title"])
+            session.close()
+
+        def project_tuple() -> None:
+            session = db.session()
+            BenchProjectItem.project(session, ["id", "title"], as_dict=False)
+            session.close()
+
+        print(f"{rows} rows")
+        print(f"{'query().all() + to_dict(all columns)':<40} {timed(orm_to_dict_all_columns):>8.2f} ms")
+        print(f"{'query().all() + to_dict([id, title])':<40} {timed(orm_to_dict):>8.2f} ms")
+        print(f"{'project([id, title])':<40} {timed(project_dict):>8.2f} ms")
+        print(f"{'project([id, title], as_dict=False)':<40} {timed(project_tuple):>8.2f} ms")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    args = parser.parse_args()
+    run(rows=args.rows)
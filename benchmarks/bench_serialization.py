@@ -0,0 +1,63 @@
+"""
+Compare FastAPI's default response path with `BaseSchema.dump_orm_list` + `ORJSONResponse`.
+
+    python benchmarks/bench_serialization.py --rows 5000
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+from typing import Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from pydantic import parse_obj_as  # noqa: E402
+
+from example_api.model import ItemModel, ItemOutDateSchema  # noqa: E402
+from yodo1.fastapi import ORJSONResponse  # noqa: E402
+
+
+def timed(func: Callable[[], None], repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(rows: int) -> None:
+    start = datetime.datetime(2021, 1, 1)
+    items: List[ItemModel] = [
+        ItemModel(id=i,
+                  title=f"item {i}",
+                  created_at=start + datetime.timedelta(minutes=i),
+                  updated_at=start + datetime.timedelta(minutes=i // 10))
+        for i in range(rows)
+    ]
+
+    def fastapi_default() -> None:
+        # What FastAPI does with response_model=List[ItemOutDateSchema]
+        content = parse_obj_as(List[ItemOutDateSchema], items)
+        JSONResponse(jsonable_encoder(content))
+
+    def dump_with_json() -> None:
+        JSONResponse(ItemOutDateSchema.dump_orm_list(items))
+
+    def dump_with_orjson() -> None:
+        ORJSONResponse(ItemOutDateSchema.dump_orm_list(items))
+
+    print(f"{rows} rows")
+    print(f"{'validate + jsonable_encoder + JSONResponse':<45} {timed(fastapi_default):>8.2f} ms")
+    print(f"{'dump_orm_list + JSONResponse':<45} {timed(dump_with_json):>8.2f} ms")
+    print(f"{'dump_orm_list + ORJSONResponse':<45} {timed(dump_with_orjson):>8.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    args = parser.parse_args()
+    run(rows=args.rows)
@@ -0,0 +1,44 @@
+"""
+Cost per uvicorn access log line of the access log filters.
+
+    python benchmarks/bench_uvicorn.py --lines 200000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yodo1.uvicorn import AccessLogFilter  # noqa: E402
+
+
+class MessageHealthCheckFilter(logging.Filter):
+    """
+    The previous implementation, formats every message.
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        return 'GET /health_check' not in record.getMessage()
+
+
+def cost(log_filter: logging.Filter, lines: int) -> float:
+    record = logging.LogRecord('uvicorn.access', logging.INFO, __file__, 1, '%s - "%s %s HTTP/%s" %d',
+                               ('10.0.0.1:53422', 'GET', '/api/v1/items?page=2', '1.1', 200), None)
+    start = time.perf_counter()
+    for _ in range(lines):
+        log_filter.filter(record)
+    return (time.perf_counter() - start) / lines * 1e9
+
+
+def run(lines: int) -> None:
+    print(f"{'getMessage() substring':<32} {cost(MessageHealthCheckFilter(), lines):>8,.0f} ns/line")
+    print(f"{'AccessLogFilter':<32} {cost(AccessLogFilter(), lines):>8,.0f} ns/line")
+    print(f"{'AccessLogFilter + sampling':<32} {cost(AccessLogFilter(status_sampling={'2xx': 10}), lines):>8,.0f} ns/line")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=200000)
+    args = parser.parse_args()
+    run(lines=args.lines)
@@ -0,0 +1,299 @@
+"""
+Load test the example_api service end to end, reports RPS and latency percentiles per endpoint.
+
+Starts the app under uvicorn with a seeded SQLite database and local JWT keys,
+then drives concurrent traffic with signed tokens from `example_api/keys.py`.
+
+    python benchmarks/loadtest.py --workers 4 --concurrency 64 --duration 20
+
+    # Against a running service, tokens must be signed with the same keys
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000
+
+    # In process through the ASGI transport, without uvicorn and network
+    python benchmarks/loadtest.py --in-process
+
+    # Choose endpoints and weights
+    python benchmarks/loadtest.py --endpoint /secret_data=3 --endpoint /items_page=1
+"""
+import argparse
+import asyncio
+import bisect
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# (path, weight, needs token)
+DEFAULT_ENDPOINTS = [
+    ("/health_check", 1, False),
+    ("/secret_data", 3, True),
+    ("/items_page", 2, False),
+    ("/items_with_date_fast", 1, False),
+]
+AUTH_ENDPOINTS = {"/secret_data"}
+
+
+class EndpointStats:
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.status: Dict[int, int] = {}
+
+    def observe(self, seconds: float, status: Optional[int]) -> None:
+        # Keep sorted for percentiles, the sample size of a load test run fits in memory
+        bisect.insort(self.latencies, seconds)
+        if status is None:
+            self.errors += 1
+        else:
+            self.status[status] = self.status.get(status, 0) + 1
+            if status >= 400:
+                self.errors += 1
+
+    def percentile(self, percent: float) -> float:
+        if not self.latencies:
+            return 0
+        index = min(len(self.latencies) - 1, int(len(self.latencies) * percent / 100))
+        return self.latencies[index] * 1000
+
+    def report(self, duration: float) -> Dict[str, Any]:
+        count = len(self.latencies)
+        return {
+            "requests": count,
+            "rps": round(count / duration, 1),
+            "errors": self.errors,
+            "status": self.status,
+            "p50_ms": round(self.percentile(50), 2),
+            "p90_ms": round(self.percentile(90), 2),
+            "p99_ms": round(self.percentile(99), 2),
+            "max_ms": round(self.latencies[-1] * 1000, 2) if count else 0,
+        }
+
+
+def make_tokens(count: int) -> List[str]:
+    from example_api.keys import PRIVATE_KEY, PUBLIC_KEY
+    from yodo1.sso import JWTHelper, JWTPayload
+
+    helper = JWTHelper()
+    helper.setup_keys(public_key=PUBLIC_KEY, private_key=PRIVATE_KEY)
+    return [
+        helper.encode_token(JWTPayload(sub=str(i), email=f"user{i}@yodo1.com", name=f"user {i}", scope=["loadtest"]))
+        for i in range(count)
+    ]
+
+
+def seed_items(sqlite_path: str, rows: int) -> None:
+    """
+    Create tables and seed items on a fresh database, before the app workers start.
+    """
+    os.environ["EXAMPLE_API_SQLITE_PATH"] = sqlite_path
+    from example_api.base import db, engine
+    from example_api.model import ItemModel
+    from yodo1.sqlalchemy import Base
+
+    Base.metadata.create_all(bind=engine)
+    session = db.session()
+    try:
+        session.query(ItemModel).delete()
+        session.bulk_save_objects([ItemModel(title=f"Title {i}") for i in range(rows)])
+        session.commit()
+    finally:
+        session.close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_uvicorn(port: int, workers: int, sqlite_path: str) -> subprocess.Popen:
+    env = dict(os.environ,
+               EXAMPLE_API_SQLITE_PATH=sqlite_path,
+               EXAMPLE_API_LOCAL_KEYS="1",
+               PYTHONPATH=ROOT)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "example_api.main:app",
+         "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{url}/health_check", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"{url} is not ready after {timeout}s")
+
+
+def parse_endpoints(values: Optional[Sequence[str]]) -> List[Tuple[str, int, bool]]:
+    if not values:
+        return DEFAULT_ENDPOINTS
+    endpoints = []
+    for value in values:
+        path, _, weight = value.partition("=")
+        endpoints.append((path, int(weight or 1), path in AUTH_ENDPOINTS))
+    return endpoints
+
+
+async def drive(client: httpx.AsyncClient,
+                endpoints: List[Tuple[str, int, bool]],
+                tokens: List[str],
+                *,
+                concurrency: int,
+                duration: float,
+                requests: Optional[int] = None) -> Tuple[Dict[str, EndpointStats], float]:
+    """
+    Run `concurrency` workers in a closed loop until `duration` seconds or `requests` total requests.
+    """
+    schedule = itertools.cycle([(path, needs_token) for path, weight, needs_token in endpoints for _ in range(weight)])
+    token_cycle = itertools.cycle(tokens)
+    stats: Dict[str, EndpointStats] = {path: EndpointStats() for path, _, _ in endpoints}
+    counter = itertools.count()
+    start = time.perf_counter()
+    deadline = start + duration
+
+    async def worker() -> None:
+        while time.perf_counter() < deadline:
+            if requests is not None and next(counter) >= requests:
+                return
+            path, needs_token = next(schedule)
+            headers = {"Authorization": f"Bearer {next(token_cycle)}"} if needs_token else None
+            sent_at = time.perf_counter()
+            try:
+                response = await client.get(path, headers=headers)
+                status: Optional[int] = response.status_code
+            except httpx.HTTPError:
+                status = None
+            stats[path].observe(time.perf_counter() - sent_at, status)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return stats, time.perf_counter() - start
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{'endpoint':<24} {'requests':>9} {'rps':>9} {'errors':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for path, row in report["endpoints"].items():
+        print(f"{path:<24} {row['requests']:>9} {row['rps']:>9.1f} {row['errors']:>7} "
+              f"{row['p50_ms']:>8.2f} {row['p90_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['max_ms']:>8.2f}")
+    total = report["total"]
+    print(f"{'total':<24} {total['requests']:>9} {total['rps']:>9.1f} {total['errors']:>7}")
+
+
+def build_report(stats: Dict[str, EndpointStats], duration: float, options: Dict[str, Any]) -> Dict[str, Any]:
+    endpoints = {path: endpoint.report(duration) for path, endpoint in stats.items()}
+    requests = sum(row["requests"] for row in endpoints.values())
+    return {
+        "options": options,
+        "duration": round(duration, 3),
+        "endpoints": endpoints,
+        "total": {
+            "requests": requests,
+            "rps": round(requests / duration, 1),
+            "errors": sum(row["errors"] for row in endpoints.values()),
+        },
+    }
+
+
+async def run_in_process(args: argparse.Namespace,
+                         endpoints: List[Tuple[str, int, bool]],
+                         tokens: List[str]) -> Tuple[Dict[str, EndpointStats], float]:
+    os.environ["EXAMPLE_API_LOCAL_KEYS"] = "1"
+    from example_api.main import app, startup_event
+
+    # ASGITransport does not run lifespan events
+    await startup_event()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        return await drive(client, endpoints, tokens,
+                           concurrency=args.concurrency, duration=args.duration, requests=args.requests)
+
+
+async def run_http(url: str,
+                   args: argparse.Namespace,
+                   endpoints: List[Tuple[str, int, bool]],
+                   tokens: List[str]) -> Tuple[Dict[str, EndpointStats], float]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+        # Warm up connections and worker imports
+        await asyncio.gather(*[client.get("/health_check") for _ in range(args.concurrency)])
+        return await drive(client, endpoints, tokens,
+                           concurrency=args.concurrency, duration=args.duration, requests=args.requests)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=None, help="target a running service instead of starting uvicorn")
+    parser.add_argument("--in-process", action="store_true", help="drive the app through the ASGI transport")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--requests", type=int, default=None, help="stop after this many requests")
+    parser.add_argument("--timeout", type=float, default=10, help="request timeout in seconds")
+    parser.add_argument("--items", type=int, default=1000, help="seeded item rows")
+    parser.add_argument("--tokens", type=int, default=100, help="distinct signed tokens")
+    parser.add_argument("--endpoint", action="append", help="path=weight, repeatable")
+    parser.add_argument("--json", default=None, help="write the report to this file")
+    args = parser.parse_args()
+
+    if not args.url and not args.in_process and importlib.util.find_spec("uvicorn") is None:
+        parser.error("uvicorn is not installed, install it or use --in-process")
+
+    # Request logs of the client and the in process app would be part of the measurement
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    # Test keys are shorter than jwt recommends
+    warnings.simplefilter("ignore")
+
+    endpoints = parse_endpoints(args.endpoint)
+    tokens = make_tokens(args.tokens)
+    options = {key: value for key, value in vars(args).items() if key != "json"}
+
+    with tempfile.TemporaryDirectory() as folder:
+        process = None
+        if args.url:
+            stats, duration = asyncio.run(run_http(args.url, args, endpoints, tokens))
+        else:
+            sqlite_path = os.path.join(folder, "loadtest.sqlite")
+            seed_items(sqlite_path, args.items)
+            if args.in_process:
+                stats, duration = asyncio.run(run_in_process(args, endpoints, tokens))
+            else:
+                port = free_port()
+                url = f"http://127.0.0.1:{port}"
+                process = start_uvicorn(port, args.workers, sqlite_path)
+                try:
+                    wait_ready(url, process)
+                    stats, duration = asyncio.run(run_http(url, args, endpoints, tokens))
+                finally:
+                    process.terminate()
+                    process.wait(timeout=30)
+
+    report = build_report(stats, duration, options)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,8 @@ from yodo1.sso import JWTHelper, JWTPayload
 # Define db base engine
 APP_PATH = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
 
-sqlite_path = os.path.join(APP_PATH, 'test-db.sqlite')
+# Load test uses its own database, see benchmarks/loadtest.py
+sqlite_path = os.getenv('EXAMPLE_API_SQLITE_PATH', os.path.join(APP_PATH, 'test-db.sqlite'))
 db_rui = f"sqlite:///{sqlite_path}"
 engine = create_engine(
     db_rui, connect_args={"check_same_thread": False}
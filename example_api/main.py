@@ -1,12 +1,19 @@
-from typing import Dict, List
+import os
+from typing import Dict, List, Optional
 
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 
-from example_api.base import auth, get_current_user_dict, db
-from example_api.keys import PUBLIC_KEY_URL
+from example_api.base import auth, get_current_user_dict, db, engine
+from example_api.keys import PUBLIC_KEY, PUBLIC_KEY_URL
 from example_api.model import ItemModel, ItemOutSchema, ItemOutDateSchema
-from yodo1.logger import logger
+from yodo1.fastapi import ORJSONResponse
+from yodo1.logger import init_logger, logger
+from yodo1.pydantic import CursorPageSchema
+from yodo1.sqlalchemy import InvalidCursorException, KeysetPage
+from yodo1.timing import TimedRoute, TimingMetrics, TimingMiddleware, instrument_engine
+
+init_logger(style='simple')
 
 description = """
 Api endpoint for PA2 project, auth via yodo1-sso service with `api/yodo1/login` endpoint.
@@ -14,11 +21,20 @@ Api endpoint for PA2 project, auth via yodo1-sso service with `api/yodo1/login`
 
 app = FastAPI(version='0.0.1',
               description=description)
+app.router.route_class = TimedRoute
+
+timing_metrics = TimingMetrics()
+app.add_middleware(TimingMiddleware, metrics=timing_metrics)
+instrument_engine(engine)
 
 
 @app.on_event("startup")
 async def startup_event() -> None:
-    auth.setup_with_sso_server(PUBLIC_KEY_URL)
+    # Load test runs without the sso server
+    if os.getenv('EXAMPLE_API_LOCAL_KEYS') == '1':
+        auth.setup_keys(public_key=PUBLIC_KEY)
+    else:
+        auth.setup_with_sso_server(PUBLIC_KEY_URL)
 
 
 @app.on_event("shutdown")
@@ -26,6 +42,11 @@ async def shutdown_event() -> None:
     logger.info('Shutdown events')
 
 
+@app.get("/metrics/timing", response_model=Dict)
+async def get_timing_metrics() -> Dict:
+    return timing_metrics.snapshot()
+
+
 @app.get("/health_check", response_model=Dict)
 async def health_check() -> Dict:
     return {'health': 'normal'}
@@ -36,11 +57,26 @@ async def health_check(user: Dict = Depends(get_current_user_dict)) -> Dict:
     return {'secret': 'true', 'user': user}
 
 
-@app.get('items', response_model=List[ItemOutSchema])
+@app.get('/items', response_model=List[ItemOutSchema])
 async def get_items(session: Session = Depends(db.get_session)):
     return session.query(ItemModel).all()
 
 
-@app.get('items_with_date', response_model=List[ItemOutDateSchema])
+@app.get('/items_with_date', response_model=List[ItemOutDateSchema])
 async def get_items(session: Session = Depends(db.get_session)):
     return session.query(ItemModel).all()
+
+
+@app.get('/items_with_date_fast', response_model=List[ItemOutDateSchema])
+async def get_items_fast(session: Session = Depends(db.get_session)) -> ORJSONResponse:
+    return ORJSONResponse(ItemOutDateSchema.dump_orm_list(session.query(ItemModel).all()))
+
+
+@app.get('/items_page', response_model=CursorPageSchema[ItemOutDateSchema])
+async def get_items_page(cursor: Optional[str] = None,
+                         limit: int = Query(20, ge=1, le=100),
+                         session: Session = Depends(db.get_session)) -> KeysetPage:
+    try:
+        return ItemModel.paginate(session, limit=limit, cursor=cursor)
+    except InvalidCursorException:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
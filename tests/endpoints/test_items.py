@@ -2,6 +2,7 @@ from fastapi.testclient import TestClient
 
 from example_api.base import db
 from example_api.model import ItemModel
+from yodo1.sqlalchemy import encode_cursor
 
 
 def test_db(client: TestClient) -> None:
@@ -18,3 +19,53 @@ def test_db(client: TestClient) -> None:
     res = client.get('/items')
     items = res.json()
     assert len(items) > 0
+
+
+def test_items_page(client: TestClient) -> None:
+    session = db.SessionLocal()
+    session.add_all([ItemModel(title=f'Page Item {i}') for i in range(5)])
+    session.commit()
+    total_count = session.query(ItemModel).count()
+    session.close()
+
+    ids = []
+    cursor = None
+    while True:
+        params = {'limit': 2}
+        if cursor:
+            params['cursor'] = cursor
+        res = client.get('/items_page', params=params)
+        assert res.status_code == 200
+        page = res.json()
+        assert len(page['items']) <= 2
+        ids += [item['id'] for item in page['items']]
+        cursor = page['next_cursor']
+        if not page['has_more']:
+            assert cursor is None
+            break
+
+    assert len(ids) == total_count
+    assert len(set(ids)) == total_count
+
+    res = client.get('/items_page', params={'cursor': 'broken-cursor'})
+    assert res.status_code == 400
+
+    # Well formed cursor with a value of the wrong type
+    cursor = encode_cursor(['created_at', 'id'], ['garbage', 1])
+    res = client.get('/items_page', params={'cursor': cursor})
+    assert res.status_code == 400
+
+    for limit in [0, -1, 101]:
+        res = client.get('/items_page', params={'limit': limit})
+        assert res.status_code == 422
+
+
+def test_items_fast(client: TestClient) -> None:
+    session = db.SessionLocal()
+    session.add(ItemModel(title='Fast Item'))
+    session.commit()
+    session.close()
+
+    fast = client.get('/items_with_date_fast')
+    assert fast.status_code == 200
+    assert fast.json() == client.get('/items_with_date').json()
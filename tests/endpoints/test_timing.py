@@ -0,0 +1,56 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+from example_api.keys import PRIVATE_KEY, PUBLIC_KEY
+from example_api.main import auth, timing_metrics
+from yodo1.sso import JWTPayload
+from yodo1.timing import RequestTiming, _current_timing, _on_connect, instrument_engine
+
+
+def _server_timing(header: str) -> dict:
+    phases = {}
+    for item in header.split(', '):
+        name, duration = item.split(';dur=')
+        phases[name] = float(duration)
+    return phases
+
+
+def test_server_timing(client: TestClient) -> None:
+    auth.setup_keys(public_key=PUBLIC_KEY, private_key=PRIVATE_KEY)
+    auth.public_key_url = None
+    auth.scope = None
+    token = auth.encode_token(JWTPayload(sub='1', name='John Doe', scope=[], email='test@yodo1.com'))
+
+    r = client.get('/secret_data', headers={'Authorization': f'Bearer {token}'})
+    assert r.status_code == 200
+    phases = _server_timing(r.headers['server-timing'])
+    assert {'auth', 'endpoint', 'serialize', 'total'} <= set(phases)
+
+    r = client.get('/items_with_date')
+    phases = _server_timing(r.headers['server-timing'])
+    assert {'db', 'endpoint', 'serialize', 'total'} <= set(phases)
+    assert phases['total'] >= phases['db']
+
+    snapshot = client.get('/metrics/timing').json()
+    assert snapshot['GET /secret_data']['count'] >= 1
+    assert 'auth' in snapshot['GET /secret_data']['phases_avg_ms']
+    assert snapshot['GET /items_with_date']['p99_ms'] > 0
+    assert timing_metrics.snapshot()['GET /items_with_date']['count'] >= 1
+
+
+def test_instrument_engine_after_dispose() -> None:
+    engine = create_engine('sqlite://', poolclass=QueuePool)
+    instrument_engine(engine)
+    instrument_engine(engine)
+    engine.dispose()
+
+    timing = RequestTiming()
+    token = _current_timing.set(timing)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+    finally:
+        _current_timing.reset(token)
+    assert set(timing.phases) == {'db_connect', 'db'}
+    assert list(engine.pool.dispatch.connect).count(_on_connect) == 1
@@ -0,0 +1,31 @@
+from tests.helpers import FakeTimer
+from yodo1.cache import TTLCache
+
+
+def test_ttl_cache_lru() -> None:
+    evicted = []
+    cache = TTLCache(max_size=2, ttl=10, on_evict=lambda k, v: evicted.append(k))
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert 'b' not in cache
+    assert evicted == ['b']
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.get('b', 'missing') == 'missing'
+    assert cache.hits == 3
+    assert cache.misses == 1
+
+
+def test_ttl_cache_expire() -> None:
+    timer = FakeTimer()
+    cache = TTLCache(max_size=10, ttl=5, timer=timer)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=20)
+    timer.now = 6
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    assert len(cache) == 1
+    assert cache.pop('b') == 2
+    assert len(cache) == 0
@@ -0,0 +1,163 @@
+import json
+import logging
+import subprocess
+import sys
+
+import pytest
+
+from tests.helpers import FakeTimer
+from yodo1 import logger as yodo1_logger
+from yodo1.logger import (JSONFormatter, NonBlockingQueueHandler, SamplingFilter, change_default_log_levels, get_formatter,
+                          init_logger)
+
+
+def _make_record(msg: str) -> logging.LogRecord:
+    return logging.LogRecord('test', logging.INFO, __file__, 1, msg, None, None)
+
+
+def _drain(handler: NonBlockingQueueHandler) -> list:
+    messages = []
+    while not handler.log_queue.empty():
+        messages.append(handler.log_queue.get_nowait().getMessage())
+    return messages
+
+
+def test_queue_handler_drop_new() -> None:
+    handler = NonBlockingQueueHandler(queue_size=2, drop_policy='drop_new')
+    for i in range(3):
+        handler.handle(_make_record(f'message {i}'))
+    assert handler.dropped == 1
+    assert _drain(handler) == ['message 0', 'message 1']
+
+    handler.handle(_make_record('message 3'))
+    assert _drain(handler) == ['1 log records dropped, log queue is full', 'message 3']
+
+
+def test_queue_handler_drop_old() -> None:
+    handler = NonBlockingQueueHandler(queue_size=2, drop_policy='drop_old')
+    for i in range(3):
+        handler.handle(_make_record(f'message {i}'))
+    assert handler.dropped == 1
+    assert _drain(handler) == ['message 1', 'message 2']
+
+
+def test_queue_handler_keeps_stack_trace() -> None:
+    handler = NonBlockingQueueHandler()
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        record = logging.LogRecord('test', logging.ERROR, __file__, 1, 'failed %s', ('job-1',), sys.exc_info())
+    handler.handle(record)
+    queued = handler.log_queue.get_nowait()
+    assert queued is not record
+    assert queued.exc_info is None
+    data = json.loads(JSONFormatter().format(queued))
+    assert data['message'] == 'failed job-1'
+    assert 'ValueError: boom' in data['error.stack_trace']
+
+
+def test_init_logger_with_queue() -> None:
+    root_logger = logging.getLogger()
+    original_handlers = root_logger.handlers[:]
+    # Remove handlers from pytest, otherwise basicConfig does nothing
+    root_logger.handlers = []
+    try:
+        init_logger('INFO', use_queue=True, queue_size=100)
+        handler = yodo1_logger._installed_handler
+        assert isinstance(handler, NonBlockingQueueHandler)
+        assert yodo1_logger._queue_listener is not None
+        assert root_logger.handlers == [handler]
+
+        init_logger('INFO')
+        assert yodo1_logger._queue_listener is None
+        assert len(root_logger.handlers) == 1
+        assert not isinstance(root_logger.handlers[0], NonBlockingQueueHandler)
+    finally:
+        root_logger.handlers = original_handlers
+
+
+def test_json_formatter() -> None:
+    formatter = get_formatter('json')
+    assert isinstance(formatter, JSONFormatter)
+
+    record = _make_record('hello %s')
+    record.args = ('world',)
+    record.elasticapm_trace_id = 'trace-1'
+    record.elasticapm_transaction_id = 'transaction-1'
+    data = json.loads(formatter.format(record))
+    assert data['message'] == 'hello world'
+    assert data['log.level'] == 'INFO'
+    assert data['log.logger'] == 'test'
+    assert data['trace.id'] == 'trace-1'
+    assert data['transaction.id'] == 'transaction-1'
+    assert data['process'] == record.process
+    assert data['@timestamp'].endswith('Z')
+
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        record = logging.LogRecord('test', logging.ERROR, __file__, 1, 'failed', None, sys.exc_info())
+    record.user_id = 42
+    data = json.loads(JSONFormatter(extra_fields=['user_id']).format(record))
+    assert 'ValueError: boom' in data['error.stack_trace']
+    assert data['user_id'] == 42
+    assert 'trace.id' not in data
+
+
+def test_import_without_side_effects() -> None:
+    code = (
+        "import logging, sys\n"
+        "hook, stderr = sys.excepthook, sys.stderr\n"
+        "import yodo1.logger\n"
+        "assert not logging.getLogger().handlers\n"
+        "assert sys.excepthook is hook and sys.stderr is stderr\n"
+        "assert 'pretty_errors' not in sys.modules\n"
+        "assert 'colorlog' not in sys.modules\n"
+    )
+    result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert result.returncode == 0, result.stderr.decode()
+    assert result.stdout == b''
+
+
+def test_sampling_filter_every_n() -> None:
+    sampling = SamplingFilter(every_n=3, max_level=logging.INFO)
+    passed = [sampling.filter(_make_record(f'message {i}')) for i in range(7)]
+    assert passed == [True, False, False, True, False, False, True]
+    assert sampling.suppressed == 4
+
+    # Records above max_level always pass
+    warning = logging.LogRecord('test', logging.WARNING, __file__, 1, 'warning', None, None)
+    assert all(sampling.filter(warning) for _ in range(5))
+
+
+def test_sampling_filter_per_second() -> None:
+    timer = FakeTimer()
+    sampling = SamplingFilter(per_second=2, max_level='INFO', timer=timer)
+    passed = [sampling.filter(_make_record(f'message {i}')) for i in range(5)]
+    assert passed == [True, True, False, False, False]
+
+    timer.now = 0.5
+    record = _make_record('message %d')
+    record.args = (5,)
+    assert sampling.filter(record)
+    # The record is not changed, the formatters add the suffix
+    assert record.getMessage() == 'message 5'
+    assert record.suppressed_records == 3
+    assert json.loads(JSONFormatter().format(record))['message'] == 'message 5 [3 similar records suppressed]'
+    assert get_formatter('simple').format(record).endswith('message 5\x1b[0m [3 similar records suppressed]')
+    assert not sampling.filter(_make_record('message 6'))
+    assert sampling.suppressed == 4
+
+
+def test_sampling_filter_invalid_arguments() -> None:
+    for kwargs in [{}, {'every_n': 2, 'per_second': 1}, {'every_n': 0}, {'per_second': 0}]:
+        with pytest.raises(ValueError):
+            SamplingFilter(**kwargs)
+
+
+def test_install_sampling_filter() -> None:
+    change_default_log_levels(log_sampling={'test.sampling': {'every_n': 10}})
+    change_default_log_levels(log_sampling={'test.sampling': {'per_second': 5}})
+    filters = logging.getLogger('test.sampling').filters
+    assert len(filters) == 1
+    assert filters[0].per_second == 5
@@ -0,0 +1,118 @@
+import logging
+import multiprocessing
+import threading
+
+import pytest
+
+from tests.helpers import FakeTimer
+from yodo1.progress import ProgressBar
+
+
+def _logged_indexes(caplog) -> list:  # type: ignore
+    return [int(r.getMessage().split('|')[2].split('/')[0]) for r in caplog.records if r.name == 'yodo1.progress']
+
+
+def test_progress_bar_step(caplog) -> None:  # type: ignore
+    caplog.set_level(logging.INFO, logger='yodo1.progress')
+    p = ProgressBar(total=23, desc='Hacking ...', step=5)
+    for _ in range(23):
+        p.update()
+    assert _logged_indexes(caplog) == [5, 10, 15, 20, 23]
+
+
+def test_progress_bar_step_batch_update(caplog) -> None:  # type: ignore
+    caplog.set_level(logging.INFO, logger='yodo1.progress')
+    p = ProgressBar(total=100, desc='Hacking ...', step=10)
+    for _ in range(14):
+        p.update(7)
+    # Logs once when crossing every step, instead of only on exact multiples
+    assert _logged_indexes(caplog) == [14, 21, 35, 42, 56, 63, 70, 84, 91]
+
+
+def test_progress_bar_min_interval(caplog) -> None:  # type: ignore
+    caplog.set_level(logging.INFO, logger='yodo1.progress')
+    timer = FakeTimer()
+    p = ProgressBar(total=1000, desc='Hacking ...', min_interval=10, timer=timer)
+    for i in range(1000):
+        # 1 item per 0.1 seconds, logs about every 100 items
+        timer.now = i * 0.1
+        p.update()
+    indexes = _logged_indexes(caplog)
+    assert indexes[-1] == 1000
+    assert 8 <= len(indexes) <= 11
+    assert all(b - a >= 100 for a, b in zip(indexes, indexes[1:-1]))
+
+
+def test_progress_bar_wrap(caplog) -> None:  # type: ignore
+    caplog.set_level(logging.INFO, logger='yodo1.progress')
+    assert list(ProgressBar.wrap(range(10), desc='Hacking ...', step=4)) == list(range(10))
+    assert _logged_indexes(caplog) == [4, 8, 10]
+
+
+def test_progress_bar_thread_safe() -> None:
+    p = ProgressBar(total=40000, desc='Hacking ...', step=1000, thread_safe=True)
+
+    def work() -> None:
+        for _ in range(10000):
+            p.update()
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert p.index == 40000
+
+
+def _shared_work(bar: ProgressBar) -> None:
+    for _ in range(500):
+        bar.update()
+
+
+def test_progress_bar_shared() -> None:
+    p = ProgressBar.shared(total=2000, desc='Hacking ...', step=100)
+    processes = [multiprocessing.Process(target=_shared_work, args=(p,)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert p.index == 2000
+
+
+def test_progress_bar_stats() -> None:
+    timer = FakeTimer()
+    p = ProgressBar(total=1000, desc='Hacking ...', step=100, smoothing=0.8, timer=timer)
+    p.update()
+    # 100 items/sec
+    for _ in range(199):
+        timer.now += 0.01
+        p.update(nbytes=1024)
+    stats = p.stats()
+    assert stats['index'] == 200
+    assert stats['rate'] == pytest.approx(100)
+    assert stats['bytes_rate'] == pytest.approx(102400)
+    assert stats['remaining'] == pytest.approx(8)
+
+    # Slows down to 10 items/sec, the moving average follows faster than the average since start
+    for _ in range(200):
+        timer.now += 0.1
+        p.update()
+    stats = p.stats()
+    assert stats['index'] == 400
+    assert 10 <= stats['rate'] < 15
+    assert stats['avg_rate'] > 18
+    assert stats['percent'] == 40
+    assert stats['elapsed'] == pytest.approx(21.99)
+
+
+def test_progress_bar_shared_stats() -> None:
+    timer = FakeTimer()
+    p = ProgressBar.shared(total=100, desc='Hacking ...', step=10)
+    p._timer = timer
+    for _ in range(50):
+        timer.now += 0.5
+        p.update(nbytes=10)
+    stats = p.stats()
+    assert stats['index'] == 50
+    assert stats['bytes'] == 500
+    assert stats['rate'] == pytest.approx(2)
@@ -0,0 +1,61 @@
+import datetime
+import json
+from typing import List, Optional
+
+from example_api.model import ItemModel, ItemOutDateSchema
+from yodo1.fastapi import ORJSONResponse
+from yodo1.pydantic import BaseSchema, format_date, format_datetime
+
+
+class TagSchema(BaseSchema):
+    name: str
+    day: datetime.date
+
+
+class ItemWithTagsSchema(ItemOutDateSchema):
+    tags: List[TagSchema]
+    main_tag: Optional[TagSchema]
+    note: str = 'empty'
+
+
+def test_format_datetime() -> None:
+    dt = datetime.datetime(2021, 3, 4, 5, 6, 7, 890)
+    assert format_datetime(dt) == dt.strftime('%Y-%m-%d %H:%M:%SZ')
+    assert format_date(dt.date()) == dt.strftime('%Y-%m-%d 00:00:00Z')
+
+
+def test_format_datetime_aware_offsets() -> None:
+    utc = datetime.datetime(2024, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    plus_one = datetime.datetime(2024, 1, 1, 13, tzinfo=datetime.timezone(datetime.timedelta(hours=1)))
+    # Same instant, equal and same hash
+    assert utc == plus_one
+    assert format_datetime(utc) == '2024-01-01 12:00:00Z'
+    assert format_datetime(plus_one) == plus_one.strftime('%Y-%m-%d %H:%M:%SZ') == '2024-01-01 13:00:00Z'
+
+
+def test_dump_orm() -> None:
+    now = datetime.datetime(2021, 3, 4, 5, 6, 7)
+    item = ItemModel(id=1, title='title', created_at=now, updated_at=now)
+    item.tags = [{'name': 'a', 'day': now.date()}]
+    item.main_tag = None
+
+    dumped = ItemWithTagsSchema.dump_orm(item)
+    assert dumped == {
+        'id': 1,
+        'title': 'title',
+        'created_at': '2021-03-04 05:06:07Z',
+        'updated_at': '2021-03-04 05:06:07Z',
+        'tags': [{'name': 'a', 'day': '2021-03-04 00:00:00Z'}],
+        'main_tag': None,
+        'note': 'empty',
+    }
+    assert dumped == json.loads(ItemWithTagsSchema.from_orm(item).json())
+    assert ItemOutDateSchema.dump_orm_list([item]) == [ItemOutDateSchema.dump_orm(item)]
+
+
+def test_orjson_response() -> None:
+    now = datetime.datetime(2021, 3, 4, 5, 6, 7)
+    item = ItemOutDateSchema(id=1, title='title', created_at=now, updated_at=now)
+    response = ORJSONResponse({'item': item, 'day': now.date(), 'at': now})
+    assert response.body == b'{"item":{"created_at":"2021-03-04 05:06:07Z","updated_at":"2021-03-04 05:06:07Z",' \
+                            b'"id":1,"title":"title"},"day":"2021-03-04 00:00:00Z","at":"2021-03-04 05:06:07Z"}'
@@ -0,0 +1,200 @@
+import time
+from typing import Any
+
+import pytest
+
+from sqlalchemy import INTEGER, TEXT, Column, String, create_engine, event, inspect, text
+from sqlalchemy.exc import OperationalError
+
+from example_api.base import db, engine
+from example_api.model import ItemModel
+from yodo1.sqlalchemy import BaseDBModel, DBManager, InvalidCursorException, encode_cursor
+
+
+def test_column_names_cached() -> None:
+    names = ItemModel.column_names()
+    assert names == ('created_at', 'updated_at', 'id', 'title')
+    assert ItemModel.column_names() is names
+    assert '_column_names_cache' not in ItemModel.__bases__[0].__dict__
+
+
+def test_project() -> None:
+    session = db.SessionLocal()
+    session.add(ItemModel(title='Projected Item'))
+    session.commit()
+
+    rows = ItemModel.project(session, ['id', 'title'],
+                             where=[ItemModel.title == 'Projected Item'],
+                             order_by=[ItemModel.id.desc()],
+                             limit=1)
+    assert len(rows) == 1
+    assert set(rows[0].keys()) == {'id', 'title'}
+    model = session.query(ItemModel).get(rows[0]['id'])
+    assert model.to_dict(['id', 'title']) == rows[0]
+
+    tuples = ItemModel.project(session, ['id', 'title'], where=[ItemModel.id == model.id], as_dict=False)
+    assert tuples[0].id == model.id
+    assert tuples[0].title == 'Projected Item'
+
+    all_columns = ItemModel.project(session, where=[ItemModel.id == model.id])
+    assert all_columns == [model.to_dict()]
+    session.close()
+
+
+def test_paginate_invalid_input() -> None:
+    session = db.SessionLocal()
+    for limit in [0, -1]:
+        with pytest.raises(ValueError):
+            ItemModel.paginate(session, limit=limit)
+    with pytest.raises(InvalidCursorException):
+        ItemModel.paginate(session, cursor=encode_cursor(['created_at', 'id'], ['garbage', 1]))
+    with pytest.raises(InvalidCursorException):
+        ItemModel.paginate(session, cursor=encode_cursor(['created_at', 'id'], [12, 1]))
+    session.close()
+
+
+class CachedCountryModel(BaseDBModel):
+    __tablename__ = "test_cached_country"
+    __table_args__ = {"extend_existing": True}
+
+    id = Column(INTEGER, primary_key=True, autoincrement=True, nullable=False)
+    code = Column(String(8), nullable=False, unique=True)
+    name = Column(TEXT, nullable=False)
+
+
+def test_cached_get() -> None:
+    CachedCountryModel.__table__.create(bind=engine, checkfirst=True)
+    cache = CachedCountryModel.enable_cache(ttl=60, max_size=10)
+    assert CachedCountryModel.enable_cache() is cache
+
+    session = db.SessionLocal()
+    session.query(CachedCountryModel).delete()
+    session.commit()
+    cache.clear()
+
+    # Miss is cached and invalidated by insert
+    assert CachedCountryModel.cached_get(session, code='CN') is None
+    assert CachedCountryModel.cached_get(session, code='CN') is None
+    assert cache.hits == 1
+    session.add(CachedCountryModel(code='CN', name='China'))
+    session.commit()
+
+    country = CachedCountryModel.cached_get(session, code='CN')
+    assert country.name == 'China'
+    session.close()
+
+    # Hit without session query
+    session = db.SessionLocal()
+    queries = []
+
+    def listener(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        queries.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', listener)
+    cached = CachedCountryModel.cached_get(session, code='CN')
+    assert cached is not country
+    assert cached.name == 'China'
+    assert inspect(cached).detached
+    assert CachedCountryModel.cached_get(session, as_dict=True, code='CN')['name'] == 'China'
+    assert queries == []
+    event.remove(engine, 'before_cursor_execute', listener)
+
+    # instance() merges cached row, update invalidates cache
+    model = CachedCountryModel.instance(session, code='CN')
+    assert inspect(model).persistent
+    model.name = 'People\'s Republic of China'
+    session.commit()
+    assert CachedCountryModel.cached_get(session, as_dict=True, code='CN')['name'] == 'People\'s Republic of China'
+
+    # Rows cached by other sessions between flush and commit are invalidated on commit
+    model.name = 'China'
+    session.flush()
+    reader = db.SessionLocal()
+    assert CachedCountryModel.cached_get(reader, code='CN').name == 'People\'s Republic of China'
+    reader.close()
+    session.commit()
+    assert CachedCountryModel.cached_get(session, code='CN').name == 'China'
+
+    # Uncommitted rows cached after flush are invalidated on rollback
+    model.name = 'Uncommitted'
+    session.flush()
+    assert CachedCountryModel.cached_get(session, code='CN').name == 'Uncommitted'
+    session.rollback()
+    assert CachedCountryModel.cached_get(session, code='CN').name == 'China'
+
+    session.delete(model)
+    session.commit()
+    assert CachedCountryModel.cached_get(session, code='CN') is None
+    session.close()
+
+
+def test_read_replica_routing(tmp_path: Any) -> None:
+    def make_engine(name: str) -> Any:
+        return create_engine(f"sqlite:///{tmp_path / name}", connect_args={"check_same_thread": False})
+
+    primary = make_engine('primary.sqlite')
+    replicas = [make_engine('replica-1.sqlite'), make_engine('replica-2.sqlite')]
+    for index, target in enumerate([primary] + replicas):
+        ItemModel.__table__.create(bind=target)
+        with target.begin() as conn:
+            conn.execute(ItemModel.__table__.insert(), [{
+                'id': 1, 'title': f'db-{index}', 'created_at': ItemModel.time_now(), 'updated_at': ItemModel.time_now()
+            }])
+
+    manager = DBManager(primary, replica_engines=replicas)
+    titles = []
+    for _ in range(4):
+        session = manager.read_session()
+        titles.append(session.query(ItemModel).get(1).title)
+        session.close()
+    assert titles == ['db-1', 'db-2', 'db-1', 'db-2']
+    assert [r.active for r in manager.replicas] == [0, 0]
+
+    # Flush always goes to the primary
+    session = next(manager.get_read_session())
+    model = session.query(ItemModel).get(1)
+    model.title = 'updated'
+    session.add(ItemModel(id=2, title='new'))
+    session.commit()
+    session.close()
+    primary_session = manager.session()
+    assert primary_session.query(ItemModel).get(1).title == 'updated'
+    assert primary_session.query(ItemModel).get(2).title == 'new'
+    primary_session.close()
+
+    # Reads after a write go to the primary until commit
+    session = manager.read_session()
+    session.query(ItemModel).get(1).title = 'uncommitted'
+    session.flush()
+    session.expire_all()
+    assert session.query(ItemModel).get(1).title == 'uncommitted'
+    session.rollback()
+    assert session.query(ItemModel).get(1).title.startswith('db-')
+    session.close()
+
+    # Query errors don't eject the replica
+    session = manager.read_session()
+    with pytest.raises(OperationalError):
+        session.execute(text('SELECT * FROM missing_table'))
+    session.close()
+    assert all(replica.is_healthy(time.monotonic()) for replica in manager.replicas)
+
+    # Broken replica is ejected, requests go to healthy one
+    broken = create_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.sqlite'}")
+    manager = DBManager(primary, replica_engines=[broken])
+    session = manager.read_session()
+    with pytest.raises(OperationalError):
+        session.query(ItemModel).get(1)
+    session.close()
+    assert not manager.replicas[0].is_healthy(time.monotonic())
+    manager = DBManager(primary, replica_engines=[broken, replicas[0]], replica_strategy='least_connections')
+    assert manager.check_replicas() == [manager.replicas[1]]
+    session = manager.read_session()
+    assert session.query(ItemModel).get(1).title == 'db-1'
+    session.close()
+
+    # Fallback to the primary when all replicas are ejected
+    manager.eject_replica(manager.replicas[1])
+    session = manager.read_session()
+    assert session.query(ItemModel).get(1).title == 'updated'
+    session.close()
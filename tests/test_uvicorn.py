@@ -0,0 +1,42 @@
+import logging
+
+from yodo1.logger import NonBlockingQueueHandler
+from yodo1.uvicorn import AccessLogFilter, HealthCheckFilter, patch_uvicorn_logger
+
+
+def _access_record(path: str, status_code: int = 200, method: str = 'GET') -> logging.LogRecord:
+    return logging.LogRecord('uvicorn.access', logging.INFO, __file__, 1, '%s - "%s %s HTTP/%s" %d',
+                             ('127.0.0.1:5000', method, path, '1.1', status_code), None)
+
+
+def test_access_log_filter_paths() -> None:
+    access_filter = AccessLogFilter(excluded_paths=['/health_check', '/metrics'])
+    assert not access_filter.filter(_access_record('/health_check'))
+    assert not access_filter.filter(_access_record('/metrics?format=text'))
+    assert access_filter.filter(_access_record('/items'))
+    assert access_filter.filter(_access_record('/health_check_v2'))
+
+    health_check_filter = HealthCheckFilter()
+    assert not health_check_filter.filter(_access_record('/health_check'))
+    other_record = logging.LogRecord('uvicorn.access', logging.INFO, __file__, 1, 'GET /health_check HTTP/1.1', None, None)
+    assert not health_check_filter.filter(other_record)
+
+
+def test_access_log_filter_status_sampling() -> None:
+    access_filter = AccessLogFilter(status_sampling={200: 3, '3xx': 2})
+    assert [access_filter.filter(_access_record('/items')) for _ in range(6)] == [True, False, False, True, False, False]
+    assert [access_filter.filter(_access_record('/login', 302)) for _ in range(4)] == [True, False, True, False]
+    assert all(access_filter.filter(_access_record('/items', 500)) for _ in range(3))
+
+
+def test_patch_uvicorn_logger() -> None:
+    uvicorn_logger = logging.getLogger('uvicorn.access')
+    patch_uvicorn_logger(excluded_paths=['/health_check'], use_queue=True)
+    patch_uvicorn_logger(excluded_paths=['/health_check'], use_queue=True)
+    try:
+        assert len(uvicorn_logger.filters) == 1
+        assert len(uvicorn_logger.handlers) == 1
+        assert isinstance(uvicorn_logger.handlers[0], NonBlockingQueueHandler)
+    finally:
+        patch_uvicorn_logger()
+    assert not isinstance(uvicorn_logger.handlers[0], NonBlockingQueueHandler)
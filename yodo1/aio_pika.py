@@ -1,14 +1,57 @@
+import asyncio
+import functools
 import logging
 import os
 import random
 import socket
-from typing import Callable, Optional
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 from urllib.parse import quote
 
 import aio_pika
 import aiormq
 from aio_pika import Channel, Connection
 
+from yodo1.rabbitmq.compression import Compressor, decompress
+from yodo1.rabbitmq.dedup import DedupCache
+
+
+async def _call_callback(callback: Callable, message: Any) -> Any:
+    if asyncio.iscoroutinefunction(callback):
+        return await callback(message)
+    # Same as aio_pika, run sync callbacks in the executor
+    return await asyncio.get_event_loop().run_in_executor(None, callback, message)
+
+
+class _AckTrackingMessage:
+    """
+    Passed to the callback instead of the incoming message, records whether the callback acked it.
+    Other attributes are read from and written to the message.
+    """
+    __slots__ = ('message', 'acked')
+
+    def __init__(self, message: aio_pika.IncomingMessage) -> None:
+        object.__setattr__(self, 'message', message)
+        object.__setattr__(self, 'acked', False)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.message, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self.message, name, value)
+
+    def ack(self, multiple: bool = False) -> asyncio.Task:
+        task = self.message.ack(multiple=multiple)
+        object.__setattr__(self, 'acked', True)
+        return task
+
+    def process(self, requeue: bool = False, reject_on_redelivered: bool = False,
+                ignore_processed: bool = False) -> Any:
+        # The context manager acks through this wrapper
+        return aio_pika.IncomingMessage.process(self, requeue=requeue,  # type: ignore
+                                                reject_on_redelivered=reject_on_redelivered,
+                                                ignore_processed=ignore_processed)
+
 
 class AsyncRabbit:
 
@@ -29,7 +72,12 @@ class AsyncRabbit:
                  password: Optional[str] = None,
                  consumer_tag: str = None,
                  virtualhost: str = '/',
-                 ssl: bool = True) -> None:
+                 ssl: bool = True,
+                 compressor: Optional[Compressor] = None) -> None:
+        """
+        :param compressor: optional, compress large published message bodies.
+                           Received bodies are always decompressed by their `content_encoding`.
+        """
         self.url = url
         self.host = host
         self.port = port
@@ -37,6 +85,7 @@ class AsyncRabbit:
         self.password = password
         self.virtualhost = virtualhost
         self.ssl = ssl
+        self.compressor = compressor
 
         if self.url is None:
             self.url = AsyncRabbit.get_uri(
@@ -55,6 +104,10 @@ class AsyncRabbit:
         self._qos = 1
         self._connection: Connection = None
         self._channel: Channel = None
+        # Every (queue, consumer_tag) registered, including tags with random suffix
+        self._consumers: List[Tuple[aio_pika.Queue, str]] = []
+        # Running callback tasks
+        self._tasks: Set[asyncio.Task] = set()
 
     async def connect(self) -> None:
         self._connection: Connection = await aio_pika.connect_robust(url=self.url)  # type: ignore
@@ -72,10 +125,18 @@ class AsyncRabbit:
                                 exchange_name: str,
                                 queue_name: str,
                                 callback: Callable,
-                                consumer_tag: str = None) -> None:
+                                consumer_tag: str = None,
+                                dedup: Optional[DedupCache] = None) -> None:
         """
         Add new callback for queue, needs to declare queue & add it to target exchange
+        :param dedup: optional, ack redelivered messages which were processed already without calling the callback.
+                      A message is recorded when the callback acks it, the callback gets a wrapper
+                      of the message which tracks the ack.
         """
+        if dedup is not None:
+            callback = self._dedup_callback(callback, dedup)
+        callback = self._decompress_callback(callback)
+        callback = self._tracked_callback(callback)
         channel = await self.live_channel()
         exchange = await channel.get_exchange(exchange_name)
         queue = await channel.declare_queue(queue_name, durable=True)
@@ -84,20 +145,90 @@ class AsyncRabbit:
 
         if consumer_tag is None:
             consumer_tag = self._consumer_tag
-        try:
-            await queue.consume(callback, consumer_tag=consumer_tag)
-        except aio_pika.exceptions.DuplicateConsumerTag:
-            consumer_tag = f"{self._consumer_tag}-{random.randint(0, 10000):05d}"
-            logging.debug(f"Consumer_tag tag duplicated, add suffix now, new: {consumer_tag}")
-            await self.register_callback(exchange_name=exchange_name,
-                                         queue_name=queue_name,
-                                         callback=callback,
-                                         consumer_tag=consumer_tag)
+        while True:
+            try:
+                await queue.consume(callback, consumer_tag=consumer_tag)
+                break
+            except aio_pika.exceptions.DuplicateConsumerTag:
+                consumer_tag = f"{self._consumer_tag}-{random.randint(0, 10000):05d}"
+                logging.debug(f"Consumer_tag tag duplicated, add suffix now, new: {consumer_tag}")
+        self._consumers.append((queue, consumer_tag))
+
+    def _tracked_callback(self, callback: Callable) -> Callable:
+        @functools.wraps(callback)
+        async def wrapper(message: aio_pika.IncomingMessage) -> Any:
+            task = asyncio.current_task()
+            if task is not None:
+                self._tasks.add(task)
+            try:
+                return await _call_callback(callback, message)
+            finally:
+                if task is not None:
+                    self._tasks.discard(task)
+        return wrapper
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Running callback count.
+        """
+        return len(self._tasks)
+
+    @staticmethod
+    def _decompress_callback(callback: Callable) -> Callable:
+        @functools.wraps(callback)
+        async def wrapper(message: aio_pika.IncomingMessage) -> Any:
+            if message.content_encoding:
+                try:
+                    body = decompress(message.body, message.content_encoding)
+                except Exception:
+                    logging.exception(f"Failed to decompress message with delivery_tag: {message.delivery_tag} "
+                                      f"content_encoding: {message.content_encoding}, reject it")
+                    await message.reject()
+                    return None
+                if body is not message.body:
+                    message.body = body
+                    message.body_size = len(body)
+                    message.content_encoding = None
+            return await _call_callback(callback, message)
+        return wrapper
+
+    @staticmethod
+    def _dedup_callback(callback: Callable, dedup: DedupCache) -> Callable:
+        async def call_dedup(func: Callable, key: str) -> Any:
+            # The persisted store does blocking db calls
+            if dedup.store is None:
+                return func(key)
+            return await asyncio.get_event_loop().run_in_executor(None, func, key)
+
+        @functools.wraps(callback)
+        async def wrapper(message: aio_pika.IncomingMessage) -> Any:
+            key = dedup.message_key(message.message_id, message.headers, message.body)
+            if key is not None and await call_dedup(dedup.is_duplicate, key):
+                logging.debug(f"Skip duplicated message with delivery_tag: {message.delivery_tag} key: {key}")
+                await message.ack()
+                return None
+            if key is None:
+                return await _call_callback(callback, message)
+
+            # Only acked messages are recorded, nacked or rejected ones are redelivered
+            tracking = _AckTrackingMessage(message)
+            result = await _call_callback(callback, tracking)
+            if tracking.acked:
+                await call_dedup(dedup.mark, key)
+            return result
+        return wrapper
 
     async def publish(self,
                       exchange_name: str,
                       message: aio_pika.Message,
                       routing_key: str = '') -> Optional[aiormq.types.ConfirmationFrameType]:
+        if self.compressor is not None and not message.content_encoding:
+            body, content_encoding = self.compressor.compress(message.body)
+            if content_encoding is not None:
+                message.body = body
+                message.body_size = len(body)
+                message.content_encoding = content_encoding
         channel = await self.live_channel()
         exchange = await channel.declare_exchange(exchange_name,
                                                   durable=True,
@@ -116,9 +247,48 @@ class AsyncRabbit:
 
     async def cancel(self) -> None:
         """
-        Cancel consumer receive new message
+        Cancel all consumers receive new message
+        """
+        consumers, self._consumers = self._consumers, []
+        for queue, consumer_tag in consumers:
+            await queue.cancel(consumer_tag)
+
+    async def drain(self, timeout: float = 30) -> Dict[str, Any]:
+        """
+        Cancel all consumers, wait for running callbacks, then close.
+        Callbacks still running after `timeout` seconds are cancelled, their messages will be redelivered.
+        :return: shutdown stats
         """
-        await self._channel.channel.basic_cancel(self._consumer_tag)
+        start = time.monotonic()
+        deadline = start + timeout
+        await self.cancel()
+
+        in_flight = len(self._tasks)
+        finished = 0
+        # Deliveries received before the cancel-ok can start new callbacks
+        while self._tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = await asyncio.wait(set(self._tasks), timeout=remaining)
+            finished += len(done)
+
+        abandoned = list(self._tasks)
+        for task in abandoned:
+            task.cancel()
+        await self.close()
+
+        stats = {
+            "in_flight": max(in_flight, finished + len(abandoned)),
+            "finished": finished,
+            "abandoned": len(abandoned),
+            "seconds": round(time.monotonic() - start, 3),
+        }
+        if abandoned:
+            logging.warning(f"Rabbit MQ drain timeout after {timeout}s, {len(abandoned)} callbacks cancelled, stats: {stats}")
+        else:
+            logging.info(f"Rabbit MQ drained, stats: {stats}")
+        return stats
 
 
 __all__ = [
@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    def __init__(self,
+                 max_size: int = 1024,
+                 ttl: float = 60,
+                 *,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+                 timer: Callable[[], float] = time.monotonic) -> None:
+        """
+        Thread safe in-memory cache with LRU eviction and TTL expiration.
+        :param max_size: max item count, least recently used item will be evicted when full
+        :param ttl: seconds before an item expires
+        :param on_evict: optional callback with (key, value) when item is evicted, expired or popped,
+                         it runs with `lock` held
+        :param timer: clock function, for testing
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        # Reentrant, so callers can hold it around several calls and their own state
+        self.lock = threading.RLock()
+
+    def _remove(self, key: Hashable) -> Any:
+        _, value = self._data.pop(key)
+        if self.on_evict:
+            self.on_evict(key, value)
+        return value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at <= self.timer():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        with self.lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (self.timer() + (self.ttl if ttl is None else ttl), value)
+            while len(self._data) > self.max_size:
+                self._remove(next(iter(self._data)))
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            for key in list(self._data):
+                self._remove(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] > self.timer()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+__all__ = [
+    'TTLCache',
+]
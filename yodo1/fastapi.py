@@ -0,0 +1,48 @@
+import json
+from typing import Any
+
+from starlette.responses import JSONResponse
+
+from yodo1.pydantic import jsonable_value
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    result = jsonable_value(value)
+    if result is value:
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+    return result
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson (fallback to json when orjson is not installed),
+    datetime and date are formatted the same way as `BaseSchema.Config.json_encoders`.
+
+    Return it directly to skip FastAPI's response_model validation and `jsonable_encoder`:
+
+        @app.get('/items', response_model=List[ItemOutDateSchema])
+        async def get_items(session: Session = Depends(db.get_session)):
+            return ORJSONResponse(ItemOutDateSchema.dump_orm_list(session.query(ItemModel).all()))
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content,
+                                default=_default,
+                                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content,
+                          default=_default,
+                          ensure_ascii=False,
+                          allow_nan=False,
+                          separators=(",", ":")).encode("utf-8")
+
+
+__all__ = [
+    'ORJSONResponse',
+]
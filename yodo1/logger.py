@@ -1,33 +1,256 @@
+import atexit
+import copy
+import itertools
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Union
 
-import pretty_errors
-from colorlog import ColoredFormatter
-
-pretty_errors.configure(
-    separator_character='*',
-    filename_display=pretty_errors.FILENAME_EXTENDED,
-    line_number_first=True,
-    display_link=True,
-    lines_before=5,
-    lines_after=2,
-    line_color=pretty_errors.RED + '> ' + pretty_errors.default_config.line_color,
-    code_color='  ' + pretty_errors.default_config.line_color,
-    truncate_code=True,
-    display_locals=True,
-    display_trace_locals=True,
-    truncate_locals=False,
-)
-
-
-def init_logger(level: str = None, style: str = 'simple') -> None:
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def configure_pretty_errors(*, display_locals: bool = False) -> None:
+    """
+    Opt-in pretty exception output, replaces the global excepthook.
+    :param display_locals: print local variables of each frame, they are truncated to keep crash output small
+    """
+    import pretty_errors
+
+    pretty_errors.configure(
+        separator_character='*',
+        filename_display=pretty_errors.FILENAME_EXTENDED,
+        line_number_first=True,
+        display_link=True,
+        lines_before=5,
+        lines_after=2,
+        line_color=pretty_errors.RED + '> ' + pretty_errors.default_config.line_color,
+        code_color='  ' + pretty_errors.default_config.line_color,
+        truncate_code=True,
+        display_locals=display_locals,
+        display_trace_locals=display_locals,
+        truncate_locals=True,
+    )
+
+
+def init_logger(level: str = None,
+                style: str = 'simple',
+                *,
+                use_queue: bool = False,
+                queue_size: int = 10000,
+                drop_policy: str = 'drop_new',
+                pretty_errors: bool = False,
+                log_sampling: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+    """
+    Setup root logger and default log levels of common libraries. Importing this module does nothing,
+    call it once at the start of the app.
+    :param level: log level, default is env `LOG_LEVEL` or DEBUG
+    :param style: `simple`, `full` or `json`
+    :param use_queue: write logs on a background thread, so the caller never blocks on stdout
+    :param queue_size: max records waiting in the queue
+    :param drop_policy: what to do when queue is full, `drop_new`, `drop_old` or `block`
+    :param pretty_errors: configure `pretty_errors` exception output, see `configure_pretty_errors`
+    :param log_sampling: optional sampling for hot path loggers, see `change_default_log_levels`
+    """
     if level is None:
         level = os.getenv('LOG_LEVEL', 'DEBUG')
-    change_log_level(level, style)
+    if pretty_errors:
+        configure_pretty_errors()
+    change_log_level(level, style, use_queue=use_queue, queue_size=queue_size, drop_policy=drop_policy)
+    change_default_log_levels(log_sampling=log_sampling)
+
+
+_exception_formatter = logging.Formatter()
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    DROP_POLICIES = ('drop_new', 'drop_old', 'block')
+
+    def __init__(self, queue_size: int = 10000, drop_policy: str = 'drop_new') -> None:
+        """
+        QueueHandler with a bounded queue, records are written by a QueueListener on a background thread.
+        :param queue_size: max records waiting in the queue
+        :param drop_policy: `drop_new` drops incoming record, `drop_old` drops the oldest record,
+                            `block` waits until queue has space when queue is full
+        """
+        if drop_policy not in self.DROP_POLICIES:
+            raise ValueError(f'Unknown drop policy: {drop_policy}')
+        self.log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        super().__init__(self.log_queue)
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self._reported_dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Merge the message and arguments on a copy of the record. Unlike `QueueHandler.prepare`,
+        the traceback is kept as `exc_text` instead of being appended to the message,
+        so the listener's formatter still writes it, like `error.stack_trace` of the JSON style.
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            # Tracebacks hold the frames of the caller, format them before queuing
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.drop_policy == 'block':
+            self.log_queue.put(record)
+            return
+        if self.dropped != self._reported_dropped:
+            self._report_dropped()
+        try:
+            self.log_queue.put_nowait(record)
+        except queue.Full:
+            if self.drop_policy == 'drop_old':
+                try:
+                    self.log_queue.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    self.log_queue.put_nowait(record)
+                    self.dropped += 1
+                    return
+                except queue.Full:
+                    pass
+            self.dropped += 1
+
+    def _report_dropped(self) -> None:
+        count = self.dropped - self._reported_dropped
+        warning = logging.LogRecord('yodo1.logger', logging.WARNING, __file__, 0,
+                                    '%d log records dropped, log queue is full', (count,), None)
+        try:
+            self.log_queue.put_nowait(warning)
+            self._reported_dropped += count
+        except queue.Full:
+            pass
+
+
+_queue_listener: Optional[logging.handlers.QueueListener] = None
+_installed_handler: Optional[logging.Handler] = None
+_atexit_registered = False
+
+
+def stop_queue_listener() -> None:
+    """
+    Stop the background log writer and flush remaining records, registered with atexit.
+    """
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self,
+                 *,
+                 every_n: Optional[int] = None,
+                 per_second: Optional[float] = None,
+                 max_level: Union[int, str] = logging.DEBUG,
+                 timer: Callable[[], float] = time.monotonic) -> None:
+        """
+        Keep 1 in every_n records, or at most per_second records for each level.
+        Records above max_level always pass. With per_second, the next record passed after some are dropped
+        has the count in its `suppressed_records` attribute, the formatters of this module add
+        a `[N similar records suppressed]` suffix to its message.
+        Add it to the exact logger which creates the records, like `logging.getLogger("yodo1.rabbitmq")`,
+        logger filters don't apply to records propagated from child loggers.
+        :param every_n: keep 1 in N records
+        :param per_second: max records per second, can be a fraction like 0.1
+        :param max_level: only sample records at this level or below, default is DEBUG
+        :param timer: clock function, for testing
+        """
+        super().__init__()
+        if (every_n is None) == (per_second is None):
+            raise ValueError('Set one of every_n or per_second')
+        if every_n is not None and every_n < 1:
+            raise ValueError('every_n must be at least 1')
+        if per_second is not None and per_second <= 0:
+            raise ValueError('per_second must be positive')
+        if isinstance(max_level, str):
+            max_level = logging.getLevelName(max_level.upper())
+        self.every_n = every_n
+        self.per_second = per_second
+        self.max_level: int = max_level  # type: ignore
+        self.timer = timer
+        self.suppressed = 0
+        self._capacity = max(1.0, per_second or 0)
+        # levelno -> counter for every_n, or [tokens, last_refill_at, suppressed] for per_second
+        self._counters: Dict[int, Iterator[int]] = {}
+        self._buckets: Dict[int, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        levelno = record.levelno
+        if levelno > self.max_level:
+            return True
 
+        if self.every_n is not None:
+            counter = self._counters.get(levelno)
+            if counter is None:
+                with self._lock:
+                    counter = self._counters.setdefault(levelno, itertools.count())
+            # next() on itertools.count is atomic under the GIL, no lock on the hot path
+            if next(counter) % self.every_n:
+                self.suppressed += 1
+                return False
+            return True
+
+        now = self.timer()
+        with self._lock:
+            bucket = self._buckets.get(levelno)
+            if bucket is None:
+                bucket = self._buckets[levelno] = [self._capacity, now, 0]
+            bucket[0] = min(self._capacity, bucket[0] + (now - bucket[1]) * self.per_second)  # type: ignore
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1
+            suppressed = int(bucket[2])
+            bucket[2] = 0
+        if suppressed:
+            # Other handlers and filters see the original message, the formatters add the suffix
+            record.suppressed_records = suppressed
+        return True
+
+
+def _suppressed_suffix(record: logging.LogRecord) -> str:
+    suppressed = getattr(record, 'suppressed_records', 0)
+    return f' [{suppressed} similar records suppressed]' if suppressed else ''
+
+
+def install_sampling_filter(logger_name: str, **kwargs: Any) -> SamplingFilter:
+    """
+    Add SamplingFilter to the logger, replace the one added before.
+    :param logger_name: logger name
+    :param kwargs: SamplingFilter arguments
+    """
+    target_logger = logging.getLogger(logger_name)
+    for log_filter in target_logger.filters[:]:
+        if isinstance(log_filter, SamplingFilter):
+            target_logger.removeFilter(log_filter)
+    sampling_filter = SamplingFilter(**kwargs)
+    target_logger.addFilter(sampling_filter)
+    return sampling_filter
+
+
+def get_color_formatter(style: str = 'simple') -> logging.Formatter:
+    from colorlog import ColoredFormatter
 
-def get_color_formatter(style: str = 'simple') -> ColoredFormatter:
     if style == 'simple':
         color_format = "%(log_color)s%(levelname)-5s | [%(name)s:%(filename)s:%(lineno)d] " \
                        "%(message)s"
@@ -35,37 +258,128 @@ def get_color_formatter(style: str = 'simple') -> ColoredFormatter:
         color_format = "%(log_color)s[%(process)-2s] %(levelname)-5s | " \
                        "%(name)s:%(filename)s:%(lineno)d - %(message)s"
 
-    color_formatter = ColoredFormatter(color_format,
-                                       datefmt=None,
-                                       reset=True,
-                                       log_colors={
-                                           'DEBUG': 'white',
-                                           'INFO': 'green',
-                                           'WARNING': 'purple',
-                                           'ERROR': 'red',
-                                           'CRITICAL': 'red,bg_white',
-                                       },
-                                       secondary_log_colors={},
-                                       style='%')
+    class SuppressedSuffixFormatter(ColoredFormatter):
+        def formatMessage(self, record: logging.LogRecord) -> str:
+            return super().formatMessage(record) + _suppressed_suffix(record)
+
+    color_formatter = SuppressedSuffixFormatter(color_format,
+                                                datefmt=None,
+                                                reset=True,
+                                                log_colors={
+                                                    'DEBUG': 'white',
+                                                    'INFO': 'green',
+                                                    'WARNING': 'purple',
+                                                    'ERROR': 'red',
+                                                    'CRITICAL': 'red,bg_white',
+                                                },
+                                                secondary_log_colors={},
+                                                style='%')
     return color_formatter
 
 
-def change_log_level(level: str, style: str = 'simple') -> None:
-    print('----------------------')
-    print('Logger init with level {}'.format(level))
+class JSONFormatter(logging.Formatter):
+    def __init__(self, extra_fields: Sequence[str] = ()) -> None:
+        """
+        Format record as one JSON object per line, encoded with orjson when it is installed.
+        APM trace.id and transaction.id come from elasticapm log correlation, which sets them on the record
+        when it is created, so they are correct with the queue mode too.
+        :param extra_fields: record attributes to include, like the keys passed by `logger.info(msg, extra={...})`
+        """
+        super().__init__()
+        self.extra_fields = tuple(extra_fields)
+
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None) -> str:
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z'
+
+    def to_dict(self, record: logging.LogRecord) -> Dict[str, Any]:
+        # Read the needed attributes directly instead of copying record.__dict__
+        data: Dict[str, Any] = {
+            '@timestamp': self.formatTime(record),
+            'log.level': record.levelname,
+            'log.logger': record.name,
+            'message': record.getMessage() + _suppressed_suffix(record),
+            'file': record.filename,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        trace_id = getattr(record, 'elasticapm_trace_id', None)
+        if trace_id:
+            data['trace.id'] = trace_id
+            data['transaction.id'] = getattr(record, 'elasticapm_transaction_id', None)
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['error.stack_trace'] = record.exc_text
+        for field in self.extra_fields:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        return data
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = self.to_dict(record)
+        if orjson is not None:
+            return orjson.dumps(data, default=str).decode()
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+def get_formatter(style: str = 'simple') -> logging.Formatter:
+    """
+    :param style: `simple`, `full` or `json`
+    """
+    if style == 'json':
+        return JSONFormatter()
+    return get_color_formatter(style=style)
+
+
+def change_log_level(level: str,
+                     style: str = 'simple',
+                     *,
+                     use_queue: bool = False,
+                     queue_size: int = 10000,
+                     drop_policy: str = 'drop_new') -> None:
+    global _queue_listener, _installed_handler, _atexit_registered
+    level_name = level
     level = logging.getLevelName(level)
 
-    color_formatter = get_color_formatter(style=style)
+    formatter = get_formatter(style=style)
     print_handler = logging.StreamHandler(sys.stdout)
-    print_handler.setFormatter(color_formatter)
+    print_handler.setFormatter(formatter)
     print_handler.setLevel(level)
 
-    logging.basicConfig(level=logging.DEBUG, handlers=[print_handler])
+    # Replace the handler installed by last call
+    root_logger = logging.getLogger()
+    stop_queue_listener()
+    if _installed_handler is not None:
+        root_logger.removeHandler(_installed_handler)
+        _installed_handler = None
 
-    logging.info('logging init finished')
+    handler: logging.Handler = print_handler
+    if use_queue:
+        handler = NonBlockingQueueHandler(queue_size=queue_size, drop_policy=drop_policy)
+        handler.setLevel(level)
 
+    logging.basicConfig(level=logging.DEBUG, handlers=[handler])
 
-def change_default_log_levels() -> None:
+    if handler in root_logger.handlers:
+        _installed_handler = handler
+        if isinstance(handler, NonBlockingQueueHandler):
+            _queue_listener = logging.handlers.QueueListener(handler.log_queue, print_handler, respect_handler_level=True)
+            _queue_listener.start()
+            if not _atexit_registered:
+                atexit.register(stop_queue_listener)
+                _atexit_registered = True
+
+    logging.info(f'Logger init with level {level_name}')
+
+
+def change_default_log_levels(log_sampling: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+    """
+    :param log_sampling: optional SamplingFilter arguments for each logger name,
+                         like `{"yodo1.rabbitmq": {"per_second": 10}, "pika": {"every_n": 100, "max_level": "INFO"}}`
+    """
     logging.getLogger("oss2.api").setLevel(logging.INFO)
     logging.getLogger("oss2.http").setLevel(logging.INFO)
     logging.getLogger("oss2.auth").setLevel(logging.INFO)
@@ -85,12 +399,14 @@ def change_default_log_levels() -> None:
     logging.getLogger("pika").setLevel(logging.INFO)
     logging.getLogger("charset_normalizer").setLevel(logging.WARNING)
 
+    for logger_name, sampling_kwargs in (log_sampling or {}).items():
+        install_sampling_filter(logger_name, **sampling_kwargs)
+
 
-init_logger(style='simple')
-change_default_log_levels()
 logger = logging.getLogger('app')
 
 if __name__ == "__main__":
+    init_logger(style='simple')
     logging.info('info')
     logging.info('info')
     logging.warning('warning')
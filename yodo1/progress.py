@@ -1,20 +1,92 @@
 import logging
+import math
+import multiprocessing
 import random
+import threading
 import time
+from typing import Any, Callable, ContextManager, Dict, Iterable, Iterator, Optional, TypeVar
 
 logger = logging.getLogger('yodo1.progress')
 
+ItemT = TypeVar('ItemT')
+
 
 class ProgressBar:
     WIDTH = 30
 
-    def __init__(self, total: int, desc: str, step: int = 50) -> None:
-        self.index: int = 0
+    def __init__(self,
+                 total: int,
+                 desc: str,
+                 step: int = 50,
+                 *,
+                 min_interval: Optional[float] = None,
+                 thread_safe: bool = False,
+                 smoothing: float = 0.3,
+                 timer: Callable[[], float] = time.time) -> None:
+        """
+        :param total: total count
+        :param desc: description
+        :param step: log every `step` items, ignored when `min_interval` is set
+        :param min_interval: log at most every `min_interval` seconds instead of every `step` items
+        :param thread_safe: lock on update, for updating from multiple threads
+        :param smoothing: weight of the latest speed in the moving average rate, 1 uses the latest speed only
+        :param timer: clock function
+        """
         self.total: int = total
         self.step: int = step
         self.desc: str = desc
+        self.min_interval: Optional[float] = min_interval
+        self.smoothing: float = smoothing
+        self._timer = timer
+
+        self.index: int = 0
+        self.bytes: int = 0
+        # None until the first update starts the timer
+        self._start_at: Optional[float] = None
+        self._last_log_at: float = 0
+        # Exponentially weighted moving average of items/sec and bytes/sec, sampled on check points
+        self._rate: float = 0
+        self._bytes_rate: float = 0
+        self._sample_at: float = 0
+        self._sample_index: int = 0
+        self._sample_bytes: int = 0
+        # Index that needs to check whether to log, update() only compares with it on the fast path
+        self._next_check: int = 0
+        self._lock: Optional[ContextManager] = threading.Lock() if thread_safe else None
 
-        self._start_at: float = 0
+    @classmethod
+    def shared(cls,
+               total: int,
+               desc: str,
+               step: int = 50,
+               *,
+               min_interval: Optional[float] = None,
+               smoothing: float = 0.3) -> 'ProgressBar':
+        """
+        Progress bar in shared memory, workers in other processes can update the same bar.
+        Pass it to `multiprocessing.Process` args or `Pool(initializer=..., initargs=(bar,))`,
+        it can't be sent with the task arguments.
+        """
+        return SharedProgressBar(total=total, desc=desc, step=step, min_interval=min_interval, smoothing=smoothing)
+
+    @classmethod
+    def wrap(cls,
+             iterable: Iterable[ItemT],
+             desc: str = '',
+             total: Optional[int] = None,
+             **kwargs: Any) -> Iterator[ItemT]:
+        """
+        Iterate and update progress bar, total is `len(iterable)` if not set.
+
+            for item in ProgressBar.wrap(items, desc="Processing ...", min_interval=10):
+                ...
+        """
+        if total is None:
+            total = len(iterable)  # type: ignore
+        bar = cls(total=total, desc=desc, **kwargs)
+        for item in iterable:
+            yield item
+            bar.update()
 
     def _format_time(self, secs: float) -> str:
         m, s = divmod(int(secs), 60)
@@ -24,33 +96,187 @@ class ProgressBar:
         else:
             return f'{h:d}:{m:02.0f}:{s:02.0f}'
 
+    def _format_size(self, size: float) -> str:
+        for unit in ('B', 'KB', 'MB', 'GB'):
+            if abs(size) < 1024:
+                return f'{size:.1f}{unit}'
+            size /= 1024
+        return f'{size:.1f}TB'
+
+    def _remaining_time(self, spend_time: float) -> float:
+        remaining = self.total - self.index
+        if remaining <= 0:
+            return 0
+        if self._rate > 0:
+            return remaining / self._rate
+        # No speed sample yet, fallback to the cumulative average
+        return spend_time / self.index * remaining
+
     def _get_time_string(self) -> str:
         # Fix crash when index == 0
-        if self.index == 0:
+        if self.index == 0 or self._start_at is None:
             return ""
-        spend_time = time.time() - self._start_at
-        estimated_time = spend_time / self.index * self.total
+        spend_time = self._timer() - self._start_at
+        estimated_time = spend_time + self._remaining_time(spend_time)
 
-        return f"{self._format_time(spend_time)}<{self._format_time(estimated_time)}"
+        text = f"{self._format_time(spend_time)}<{self._format_time(estimated_time)}, {self._rate:.1f}it/s"
+        if self.bytes:
+            text += f", {self._format_size(self._bytes_rate)}/s"
+        return text
 
-    def update(self, n: int = 1) -> None:
-        if self.index == 0:
-            self._start_at = time.time()
+    def update(self, n: int = 1, nbytes: int = 0) -> None:
+        """
+        :param n: finished item count
+        :param nbytes: processed bytes, shows bytes/sec when set
+        """
+        if self._lock is None:
+            self._update(n, nbytes)
+        else:
+            with self._lock:
+                self._update(n, nbytes)
 
+    def _update(self, n: int, nbytes: int) -> None:
         self.index += n
+        if nbytes:
+            self.bytes += nbytes
+        if self.index < self._next_check:
+            return
+        self._check()
+
+    def _sample(self, now: float) -> None:
+        duration = now - self._sample_at
+        if duration <= 0:
+            return
+        rate = (self.index - self._sample_index) / duration
+        bytes_rate = (self.bytes - self._sample_bytes) / duration
+        if self._rate == 0:
+            # First sample
+            self._rate = rate
+            self._bytes_rate = bytes_rate
+        else:
+            self._rate = self.smoothing * rate + (1 - self.smoothing) * self._rate
+            self._bytes_rate = self.smoothing * bytes_rate + (1 - self.smoothing) * self._bytes_rate
+        self._sample_at = now
+        self._sample_index = self.index
+        self._sample_bytes = self.bytes
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Current progress and throughput, for exporting to metrics.
+        `rate` and `bytes_rate` are moving averages, `avg_rate` is the average since start.
+        """
+        if self._lock is None:
+            return self._stats()
+        with self._lock:
+            return self._stats()
+
+    def _stats(self) -> Dict[str, Any]:
+        elapsed = self._timer() - self._start_at if self._start_at is not None else 0
+        index = self.index
+        return {
+            'desc': self.desc,
+            'index': index,
+            'total': self.total,
+            'percent': 100 * index / self.total if self.total else 0,
+            'elapsed': elapsed,
+            'remaining': self._remaining_time(elapsed) if index else math.inf,
+            'rate': self._rate,
+            'avg_rate': index / elapsed if elapsed > 0 else 0,
+            'bytes': self.bytes,
+            'bytes_rate': self._bytes_rate,
+        }
+
+    def _check(self) -> None:
+        index = self.index
+        now = self._timer()
+        if self._start_at is None:
+            self._start_at = now
+            self._last_log_at = now
+            self._sample_at = now
+            self._sample_index = index
+            self._sample_bytes = self.bytes
+        else:
+            self._sample(now)
 
         if self.total == 0:
+            self._next_check = index + self.step
+            return
+
+        if self.min_interval is None:
+            # _next_check is 0 only on the first update, which just starts the timer
+            if index >= (self._next_check or self.step) or index >= self.total:
+                self._log()
+            next_check = (index // self.step + 1) * self.step
+        else:
+            if now - self._last_log_at >= self.min_interval or index >= self.total:
+                self._last_log_at = now
+                self._log()
+            # Check the clock a few times in every interval, based on current speed
+            rate = self._rate or 1
+            next_check = index + max(1, int(rate * self.min_interval / 4))
+
+        if index < self.total:
+            next_check = min(next_check, self.total)
+        self._next_check = next_check
+
+    def _log(self) -> None:
+        if self.index == 0:
             return
+        fill_count = int(ProgressBar.WIDTH * self.index / self.total)
+        if fill_count > ProgressBar.WIDTH:
+            fill_count = ProgressBar.WIDTH
+
+        progress = f" {100 * self.index / self.total:.1f}%"
+        text = f"{progress:<8s}|" + '#' * fill_count + '-' * (ProgressBar.WIDTH - fill_count) + "| " + f"{self.index}/{self.total} "
+        text += f"[{self._get_time_string()}] {self.desc}"
+        logger.info(text)
+
+
+def _shared_field(index: int, cast: Callable[[float], Any], optional: bool = False) -> Any:
+    """
+    :param optional: None is stored as NaN
+    """
+    def getter(self: 'SharedProgressBar') -> Any:
+        value = self._state[index]
+        if optional and math.isnan(value):
+            return None
+        return cast(value)
+
+    def setter(self: 'SharedProgressBar', value: Optional[float]) -> None:
+        self._state[index] = math.nan if value is None else value
+
+    return property(getter, setter)
+
+
+class SharedProgressBar(ProgressBar):
+    """
+    ProgressBar with state in shared memory, created by `ProgressBar.shared`.
+    """
+    _FIELDS = ('index', 'bytes', '_start_at', '_last_log_at', '_next_check',
+               '_rate', '_bytes_rate', '_sample_at', '_sample_index', '_sample_bytes')
 
-        if int(self.index) % self.step == 0 or self.index == self.total:
-            fill_count = int(ProgressBar.WIDTH * self.index / self.total)
-            if fill_count > ProgressBar.WIDTH:
-                fill_count = ProgressBar.WIDTH
+    index = _shared_field(0, int)
+    bytes = _shared_field(1, int)
+    _start_at = _shared_field(2, float, optional=True)
+    _last_log_at = _shared_field(3, float)
+    _next_check = _shared_field(4, int)
+    _rate = _shared_field(5, float)
+    _bytes_rate = _shared_field(6, float)
+    _sample_at = _shared_field(7, float)
+    _sample_index = _shared_field(8, int)
+    _sample_bytes = _shared_field(9, int)
 
-            progress = f" {100 * self.index / self.total:.1f}%"
-            text = f"{progress:<8s}|" + '#' * fill_count + '-' * (ProgressBar.WIDTH - fill_count) + "| " + f"{self.index}/{self.total} "
-            text += f"[{self._get_time_string()}] {self.desc}"
-            logger.info(text)
+    def __init__(self,
+                 total: int,
+                 desc: str,
+                 step: int = 50,
+                 *,
+                 min_interval: Optional[float] = None,
+                 smoothing: float = 0.3) -> None:
+        # Raw array with one lock around update, a synchronized Array locks on every item access
+        self._state = multiprocessing.RawArray('d', len(self._FIELDS))
+        super().__init__(total=total, desc=desc, step=step, min_interval=min_interval, smoothing=smoothing)
+        self._lock = multiprocessing.Lock()
 
 
 if __name__ == '__main__':
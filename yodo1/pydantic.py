@@ -1,23 +1,121 @@
 import datetime
+import functools
+from typing import Any, Callable, Dict, Generic, Iterable, List, Optional, Tuple, TypeVar
 
 from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST, SHAPE_SEQUENCE, SHAPE_SINGLETON, SHAPE_TUPLE_ELLIPSIS, ModelField
+from pydantic.generics import GenericModel
+
+ItemT = TypeVar('ItemT')
+
+
+def format_datetime(dt: datetime.datetime) -> str:
+    """
+    Same as `dt.strftime('%Y-%m-%d %H:%M:%SZ')`, but faster.
+    Not cached, aware datetimes of the same instant with different offsets are equal keys.
+    """
+    return f'{dt.year:04d}-{dt.month:02d}-{dt.day:02d} {dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}Z'
+
+
+@functools.lru_cache(maxsize=4096)
+def format_date(dt: datetime.date) -> str:
+    """
+    Same as `dt.strftime('%Y-%m-%d 00:00:00Z')`, but faster and cached.
+    """
+    return f'{dt.year:04d}-{dt.month:02d}-{dt.day:02d} 00:00:00Z'
+
+
+def jsonable_value(value: Any) -> Any:
+    value_type = type(value)
+    if value_type is datetime.datetime:
+        return format_datetime(value)
+    if value_type is datetime.date:
+        return format_date(value)
+    if isinstance(value, BaseModel):
+        return value.dict()
+    return value
+
+
+_DumpPlan = List[Tuple[str, str, ModelField, Optional[Callable[[Any], Any]]]]
+_dump_plans: Dict[type, _DumpPlan] = {}
 
 
 class BaseSchema(BaseModel):
     class Config:
         orm_mode = True
         json_encoders = {
-            datetime.datetime: lambda dt: dt.strftime('%Y-%m-%d %H:%M:%SZ'),
-            datetime.date: lambda dt: dt.strftime('%Y-%m-%d 00:00:00Z')
+            datetime.datetime: format_datetime,
+            datetime.date: format_date
         }
 
+    @classmethod
+    def _get_dump_plan(cls) -> _DumpPlan:
+        plan = _dump_plans.get(cls)
+        if plan is None:
+            plan = []
+            for field in cls.__fields__.values():
+                nested: Optional[Callable[[Any], Any]] = None
+                if isinstance(field.type_, type) and issubclass(field.type_, BaseSchema):
+                    if field.shape == SHAPE_SINGLETON:
+                        nested = field.type_.dump_orm
+                    elif field.shape in (SHAPE_LIST, SHAPE_SEQUENCE, SHAPE_TUPLE_ELLIPSIS):
+                        nested = field.type_.dump_orm_list
+                plan.append((field.name, field.alias, field, nested))
+            _dump_plans[cls] = plan
+        return plan
+
+    @classmethod
+    def dump_orm(cls, obj: Any) -> Dict[str, Any]:
+        """
+        Fast path of `cls.from_orm(obj).dict()` + json encoding for response.
+        Skip validation, read the schema fields from the ORM object (or dict), and format datetime
+        the same way as `json_encoders`. Only use it with trusted db data.
+        :param obj: ORM object or dict
+        :return: json ready dict with field alias as key
+        """
+        if obj is None:
+            return None  # type: ignore
+        is_dict = isinstance(obj, dict)
+        result = {}
+        for name, alias, field, nested in cls._get_dump_plan():
+            if is_dict:
+                value = obj[name] if field.required else obj.get(name, field.default)
+            else:
+                value = getattr(obj, name) if field.required else getattr(obj, name, field.default)
+            if nested is not None and value is not None:
+                result[alias] = nested(value)
+            else:
+                result[alias] = jsonable_value(value)
+        return result
+
+    @classmethod
+    def dump_orm_list(cls, objs: Iterable[Any]) -> List[Dict[str, Any]]:
+        """
+        Fast path of `parse_obj_as(List[cls], objs)` + json encoding, see `dump_orm`.
+        """
+        dump = cls.dump_orm
+        return [dump(obj) for obj in objs]
+
 
 class BaseDateSchema(BaseSchema):
     created_at: datetime.datetime
     updated_at: datetime.datetime
 
 
+class CursorPageSchema(BaseSchema, GenericModel, Generic[ItemT]):
+    """
+    Response model for `BaseDBModel.paginate`, use as `CursorPageSchema[ItemOutSchema]`
+    """
+    items: List[ItemT]
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+
+
 __all__ = [
     'BaseSchema',
-    'BaseDateSchema'
+    'BaseDateSchema',
+    'CursorPageSchema',
+    'format_datetime',
+    'format_date',
+    'jsonable_value',
 ]
@@ -1,2 +1,8 @@
 from .multi_thread import MultiThreadConsumer, CallbackResult, MQAction  # noqa: F401
 from .http_client import RabbitHttpSender  # noqa: F401
+from .retry import RetryPolicy  # noqa: F401
+from .dedup import DedupCache, DBDedupStore  # noqa: F401
+from .partition import BodyPartitionKey, KeyedExecutor, body_partition_key, header_partition_key  # noqa: F401
+from .compression import Compressor, decompress  # noqa: F401
+from .payload import decode_payload  # noqa: F401
+from .sampling import TraceSampler  # noqa: F401
@@ -0,0 +1,92 @@
+import logging
+import zlib
+from typing import Callable, Dict, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover
+    lz4_frame = None
+
+logger = logging.getLogger("yodo1.rabbitmq")
+
+_Codec = Tuple[Callable[[bytes, Optional[int]], bytes], Callable[[bytes], bytes]]
+
+
+def _zlib_compress(body: bytes, level: Optional[int]) -> bytes:
+    return zlib.compress(body, -1 if level is None else level)
+
+
+def _zstd_compress(body: bytes, level: Optional[int]) -> bytes:
+    return zstandard.ZstdCompressor(level=3 if level is None else level).compress(body)
+
+
+def _zstd_decompress(body: bytes) -> bytes:
+    # Frames written by `ZstdCompressor.compress` have the content size
+    return zstandard.ZstdDecompressor().decompress(body)
+
+
+def _lz4_compress(body: bytes, level: Optional[int]) -> bytes:
+    return lz4_frame.compress(body, compression_level=0 if level is None else level)
+
+
+# `content_encoding` value -> (compress, decompress)
+CODECS: Dict[str, _Codec] = {
+    "deflate": (_zlib_compress, zlib.decompress),
+}
+if zstandard is not None:
+    CODECS["zstd"] = (_zstd_compress, _zstd_decompress)
+if lz4_frame is not None:
+    CODECS["lz4"] = (_lz4_compress, lz4_frame.decompress)
+
+
+class Compressor:
+    def __init__(self, encoding: str = "deflate", *, threshold: int = 1024, level: Optional[int] = None) -> None:
+        """
+        Compress message bodies larger than `threshold`, the encoding is set as the `content_encoding` property.
+        Consumers of this package decompress the known encodings transparently.
+
+        :param encoding: `deflate` (zlib), `zstd` needs `zstandard`, `lz4` needs `lz4`
+        :param threshold: min body size in bytes to compress, small bodies are sent as is
+        :param level: compression level of the codec, uses the codec default when empty
+        """
+        if encoding not in CODECS:
+            raise ValueError(f"Unsupported or not installed encoding: {encoding}, available: {sorted(CODECS)}")
+        self.encoding = encoding
+        self.threshold = threshold
+        self.level = level
+        self._compress = CODECS[encoding][0]
+
+    def compress(self, body: bytes) -> Tuple[bytes, Optional[str]]:
+        """
+        :return: body and its content encoding, the encoding is None when the body is not compressed
+        """
+        if len(body) < self.threshold:
+            return body, None
+        compressed = self._compress(body, self.level)
+        if len(compressed) >= len(body):
+            return body, None
+        return compressed, self.encoding
+
+
+def decompress(body: bytes, content_encoding: Optional[str]) -> bytes:
+    """
+    Decompress a message body by its `content_encoding`, unknown encodings are returned as is.
+    """
+    if not content_encoding:
+        return body
+    codec = CODECS.get(content_encoding)
+    if codec is None:
+        return body
+    return codec[1](body)
+
+
+__all__ = [
+    'CODECS',
+    'Compressor',
+    'decompress',
+]
@@ -0,0 +1,159 @@
+import datetime
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, and_, exc, select
+
+from yodo1.cache import TTLCache
+
+logger = logging.getLogger("yodo1.rabbitmq")
+
+MAX_KEY_LENGTH = 128
+
+
+class DBDedupStore:
+    def __init__(self,
+                 db: Any,
+                 *,
+                 window: float = 86400,
+                 table_name: str = "mq_processed_message",
+                 create_table: bool = True) -> None:
+        """
+        Persisted window of processed message keys, survives consumer restarts and is shared between consumers.
+        The table is not part of `yodo1.sqlalchemy.Base`, it is created here when `create_table` is set.
+
+        :param db: DBManager
+        :param window: seconds to remember a processed message
+        :param table_name: table name
+        :param create_table: create the table if not exists
+        """
+        self.db = db
+        self.window = window
+        self.table = Table(
+            table_name,
+            MetaData(),
+            Column("message_key", String(MAX_KEY_LENGTH), primary_key=True),
+            Column("processed_at", DateTime, nullable=False, index=True),
+        )
+        if create_table:
+            self.table.create(bind=db.engine, checkfirst=True)
+
+    def _since(self) -> datetime.datetime:
+        return datetime.datetime.utcnow() - datetime.timedelta(seconds=self.window)
+
+    def contains(self, key: str) -> bool:
+        query = select([self.table.c.message_key]).where(and_(
+            self.table.c.message_key == key,
+            self.table.c.processed_at >= self._since(),
+        ))
+        with self.db.engine.connect() as conn:
+            return conn.execute(query).first() is not None
+
+    def add(self, key: str) -> None:
+        now = datetime.datetime.utcnow()
+        try:
+            with self.db.engine.begin() as conn:
+                result = conn.execute(self.table.update().where(self.table.c.message_key == key).values(processed_at=now))
+                if result.rowcount == 0:
+                    conn.execute(self.table.insert().values(message_key=key, processed_at=now))
+        except exc.IntegrityError:
+            # Another consumer recorded it at the same time
+            pass
+
+    def purge(self) -> int:
+        """
+        Delete keys out of the window, call it periodically.
+        :return: deleted row count
+        """
+        with self.db.engine.begin() as conn:
+            return conn.execute(self.table.delete().where(self.table.c.processed_at < self._since())).rowcount
+
+
+class DedupCache:
+    def __init__(self,
+                 *,
+                 ttl: float = 3600,
+                 max_size: int = 100000,
+                 key_header: Optional[str] = None,
+                 hash_body: bool = False,
+                 key_func: Optional[Callable[[Optional[str], Optional[Dict], bytes], Optional[str]]] = None,
+                 store: Optional[DBDedupStore] = None) -> None:
+        """
+        Skip redelivered messages which were processed already. Duplicates are acked without calling the handler.
+        A message is recorded after the handler acks it, so failed messages are still redelivered.
+
+        The key is `key_func(message_id, headers, body)` when set, otherwise the `key_header` header,
+        then the `message_id` property, then the sha1 of the body when `hash_body` is set.
+        Messages without key are not deduplicated.
+
+        :param ttl: seconds to remember a processed message in memory
+        :param max_size: max keys in memory, least recently used keys are evicted first
+        :param key_header: header name of the key
+        :param hash_body: use the body hash when the message has no key. Off by default, two legitimate messages
+                          with the same body within `ttl` would be acked without calling the handler and lost.
+                          Only enable it when identical bodies are always the same event.
+        :param key_func: custom key function
+        :param store: optional persisted window, checked when the key is not in memory
+        """
+        self.key_header = key_header
+        self.hash_body = hash_body
+        self.key_func = key_func
+        self.store = store
+        self._cache = TTLCache(max_size=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+
+    def message_key(self, message_id: Optional[str], headers: Optional[Dict], body: bytes) -> Optional[str]:
+        if self.key_func is not None:
+            key = self.key_func(message_id, headers, body)
+        elif self.key_header is not None and headers and headers.get(self.key_header) is not None:
+            key = headers[self.key_header]
+            if isinstance(key, bytes):
+                key = key.decode()
+            key = str(key)
+        elif message_id:
+            key = message_id
+        elif self.hash_body:
+            key = f"sha1:{hashlib.sha1(body).hexdigest()}"
+        else:
+            key = None
+        if key is not None and len(key) > MAX_KEY_LENGTH:
+            key = f"sha1:{hashlib.sha1(key.encode()).hexdigest()}"
+        return key
+
+    def is_duplicate(self, key: str) -> bool:
+        duplicate = key in self._cache
+        if not duplicate and self.store is not None and self.store.contains(key):
+            duplicate = True
+            self._cache.set(key, True)
+        with self._lock:
+            self.checked += 1
+            if duplicate:
+                self.duplicates += 1
+        return duplicate
+
+    def mark(self, key: str) -> None:
+        self._cache.set(key, True)
+        if self.store is not None:
+            self.store.add(key)
+
+    @property
+    def duplicate_rate(self) -> float:
+        return self.duplicates / self.checked if self.checked else 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "duplicate_rate": self.duplicate_rate,
+            "cached_keys": len(self._cache),
+        }
+
+
+__all__ = [
+    'DBDedupStore',
+    'DedupCache',
+]
@@ -1,12 +1,16 @@
+import base64
 import json
 import logging
-from typing import Dict, Optional, Any
-from urllib.parse import quote_plus, urlparse
+from typing import Dict, Optional, Any, Tuple
+from urllib.parse import quote, quote_plus, urlparse
 
 import elasticapm
 import httpx
 from tenacity import AsyncRetrying, Retrying, stop_after_attempt, wait_random
 
+from .compression import Compressor
+from .sampling import TraceSampler
+
 logger = logging.getLogger("yodo1.rabbitmq")
 
 
@@ -18,6 +22,10 @@ class MQExchangeDeclareFailedException(Exception):
     pass
 
 
+class MQManagementRequestFailedException(Exception):
+    pass
+
+
 class RabbitHttpSender:
     def __init__(
         self,
@@ -27,6 +35,8 @@ class RabbitHttpSender:
         apm_client: elasticapm.Client = None,
         async_httpx_client: httpx.AsyncClient = httpx.AsyncClient(),
         sync_httpx_client: httpx.Client = httpx.Client(),
+        compressor: Optional[Compressor] = None,
+        sampler: Optional[TraceSampler] = None,
     ):
         """
         :param uri: rabbitmq uri
@@ -34,6 +44,8 @@ class RabbitHttpSender:
         :param apm_client: elasticapm client
         :param async_httpx_client: async httpx client
         :param sync_httpx_client: sync httpx client
+        :param compressor: optional, compress large message bodies
+        :param sampler: optional, sample APM transactions per exchange, all messages are traced when empty
         """
         self.uri = uri
 
@@ -45,6 +57,8 @@ class RabbitHttpSender:
         self.virtual_host = uri_obj.path[1:]
         self.global_max_retry = global_max_retry
         self.apm_client: elasticapm.Client = apm_client
+        self.compressor = compressor
+        self.sampler = sampler
 
         if 'amqp' in self.scheme:
             logger.warning("Please use http/https for rabbitmq HTTP sender.")
@@ -82,6 +96,19 @@ class RabbitHttpSender:
             raise MQExchangeDeclareFailedException(res.text)
         logger.info(f"Exchange {exchange_name} declared")
 
+    def queue_stats(self, queue_name: str) -> Dict[str, Any]:
+        """
+        Queue details from the management API, like `messages_ready`, `messages_unacknowledged`,
+        `consumers` and `consumer_utilisation`.
+        :param queue_name: queue name
+        :return: queue details
+        """
+        url = f"{self.scheme}://{self.host}/api/queues/{quote_plus(self.virtual_host)}/{quote(queue_name, safe='')}"
+        res = self.sync_httpx_client.get(url, auth=httpx.BasicAuth(self.username, self.password))
+        if res.status_code != 200:
+            raise MQManagementRequestFailedException(res.text)
+        return res.json()
+
     def publish(
         self,
         *,
@@ -105,7 +132,11 @@ class RabbitHttpSender:
         :return:
         """
         # setup trace context
-        traceparent_string = self._start_trace(event_name=event_name)
+        traceparent_string, traced = self._start_trace(
+            event_name=event_name,
+            exchange_name=exchange_name,
+            parent_header=((properties or {}).get("headers") or {}).get("traceparent"),
+        )
 
         if max_retry is None:
             max_retry = self.global_max_retry
@@ -117,6 +148,7 @@ class RabbitHttpSender:
             routing_key=routing_key,
             traceparent_string=traceparent_string,
             event_name=event_name,
+            compressor=self.compressor,
         )
         url = f"{self.scheme}://{self.host}/api/exchanges/{quote_plus(self.virtual_host)}/{exchange_name}/publish"
 
@@ -137,7 +169,7 @@ class RabbitHttpSender:
             logger.debug(
                 f"Successfully send MQ message to exchange: {exchange_name} trace_id: {trace_id}"
             )
-            if self.apm_client:
+            if traced:
                 self.apm_client.end_transaction(name=f"MQ PUBLISH {event_name}", result="success")
         except Exception as e:
             logger.warning(
@@ -145,6 +177,7 @@ class RabbitHttpSender:
             )
             if self.apm_client:
                 self.apm_client.capture_exception()
+            if traced:
                 self.apm_client.end_transaction(name=f"MQ PUBLISH {event_name}", result="failure")
             raise e
 
@@ -170,7 +203,11 @@ class RabbitHttpSender:
         :return:
         """
         # setup trace context
-        traceparent_string = self._start_trace(event_name=event_name)
+        traceparent_string, traced = self._start_trace(
+            event_name=event_name,
+            exchange_name=exchange_name,
+            parent_header=((properties or {}).get("headers") or {}).get("traceparent"),
+        )
 
         if max_retry is None:
             max_retry = self.global_max_retry
@@ -180,6 +217,7 @@ class RabbitHttpSender:
             routing_key=routing_key,
             traceparent_string=traceparent_string,
             event_name=event_name,
+            compressor=self.compressor,
         )
         url = f"{self.scheme}://{self.host}/api/exchanges/{quote_plus(self.virtual_host)}/{exchange_name}/publish"
         try:
@@ -199,7 +237,7 @@ class RabbitHttpSender:
                 f"Successfully send MQ message to exchange: {exchange_name} trace_id: {trace_id}"
             )
             # If successly send message
-            if self.apm_client:
+            if traced:
                 self.apm_client.end_transaction(name=f"MQ PUBLISH {event_name}", result="success")
         except Exception as e:
             logger.warning(
@@ -207,6 +245,7 @@ class RabbitHttpSender:
             )
             if self.apm_client:
                 self.apm_client.capture_exception()
+            if traced:
                 self.apm_client.end_transaction(name=f"MQ PUBLISH {event_name}", result="failure")
             raise e
 
@@ -222,26 +261,38 @@ class RabbitHttpSender:
         routing_key: str = "",
         traceparent_string: str = None,
         event_name: str = None,
+        compressor: Optional[Compressor] = None,
     ) -> Dict:
-        if properties is None:
-            properties = {}
+        # Callers may reuse one properties dict for many messages, don't change it
+        properties = dict(properties or {})
 
         # Add traceparent_string to headers
         if traceparent_string is not None and event_name is not None:
-            if "headers" in properties:
-                properties["headers"]["traceparent"] = traceparent_string
-                properties["headers"]["event_name"] = event_name
-            else:
-                properties["headers"] = {
-                    "traceparent": traceparent_string,
-                    "event_name": event_name,
+            properties["headers"] = {
+                **(properties.get("headers") or {}),
+                "traceparent": traceparent_string,
+                "event_name": event_name,
+            }
+
+        payload = json.dumps(message_body)
+        # A body with `content_encoding` set by the caller is sent as is
+        if compressor is not None and not properties.get("content_encoding"):
+            body, content_encoding = compressor.compress(payload.encode())
+            if content_encoding is not None:
+                # The HTTP API only takes binary payload as base64
+                properties["content_encoding"] = content_encoding
+                return {
+                    "properties": properties,
+                    "routing_key": routing_key,
+                    "payload_encoding": "base64",
+                    "payload": base64.b64encode(body).decode(),
                 }
 
         message = {
             "properties": properties,
             "routing_key": routing_key,
             "payload_encoding": "string",
-            "payload": json.dumps(message_body),
+            "payload": payload,
         }
         return message
 
@@ -284,21 +335,28 @@ class RabbitHttpSender:
         except Exception as e:
             raise MQSendFailedException(str(e))
 
-    def _start_trace(self, event_name: str) -> Optional[str]:
-        if self.apm_client:
-            if event_name is None:
-                raise ValueError("Must set event name when using with apm client")
-            # Get trace parent from the context if exists
-            # This will correlate this MQ with the trigger request
-            traceparent_string = elasticapm.get_trace_parent_header()
-            if traceparent_string:
-                parent = elasticapm.trace_parent_from_string(traceparent_string)
-            else:
-                parent = None
-            self.apm_client.begin_transaction(
-                transaction_type="RabbitMQ", trace_parent=parent
-            )
-            traceparent_string = elasticapm.get_trace_parent_header()
-        else:
-            traceparent_string = None
-        return traceparent_string
+    def _start_trace(self,
+                     event_name: str,
+                     exchange_name: Optional[str] = None,
+                     parent_header: Optional[str] = None) -> Tuple[Optional[str], bool]:
+        """
+        :param parent_header: `traceparent` header already in the message properties, like the one kept by
+                              the outbox, it is the parent instead of the current context
+        :return: traceparent header to send, whether a transaction is started
+        """
+        if not self.apm_client:
+            return None, False
+        if event_name is None:
+            raise ValueError("Must set event name when using with apm client")
+        # Get trace parent from the context if exists
+        # This will correlate this MQ with the trigger request
+        traceparent_string = parent_header or elasticapm.get_trace_parent_header()
+        parent = elasticapm.trace_parent_from_string(traceparent_string) if traceparent_string else None
+        if self.sampler is not None and not self.sampler.is_sampled(exchange_name, parent):
+            # Skip the transaction, consumers honouring the sampled flag skip it as well
+            return traceparent_string or self.sampler.unsampled_header(), False
+        transaction = self.apm_client.begin_transaction(transaction_type="RabbitMQ", trace_parent=parent)
+        if transaction is None:
+            # The agent is not recording
+            return traceparent_string, False
+        return transaction.trace_parent.to_string(), True
@@ -5,12 +5,22 @@ import os
 import random
 import socket
 import string
+import sys
+import time
 from concurrent.futures import Future, ThreadPoolExecutor
-from typing import Callable
+from typing import Any, Callable, Dict, List, Optional, Type
 
 import elasticapm
 import pika
 from pika.channel import Channel
+from pydantic import BaseModel
+
+from .compression import decompress
+from .dedup import DedupCache
+from .partition import BodyPartitionKey, KeyedExecutor, PartitionKeyFunc
+from .payload import BodyPreview, decode_payload, loads
+from .retry import RetryPolicy
+from .sampling import TraceSampler
 
 logger = logging.getLogger("yodo1.rabbitmq")
 
@@ -53,20 +63,31 @@ class MultiThreadConsumer:
         max_worker: int = 10,
         apm_client: elasticapm.Client = None,
         verbose: bool = False,
+        verbose_max_length: int = 1024,
+        sampler: Optional[TraceSampler] = None,
     ) -> None:
         """
         :param uri: MQ URI
         :param qos: qos
         :param max_worker: thread max worker, if you want to process MQ in single thread, set it to 1.
-        :param verbose
+        :param verbose: log received message bodies at debug level
+        :param verbose_max_length: max body bytes in the verbose log
+        :param sampler: optional, sample APM transactions per queue. When empty, messages with a sampled
+                        `traceparent` header are traced.
         """
         params = pika.URLParameters(uri)
         self.connection = pika.BlockingConnection(params)
         self.channel = self.connection.channel()
         self.channel.basic_qos(prefetch_count=qos)
         self.thread_pool = ThreadPoolExecutor(max_workers=max_worker)
+        self.keyed_executor = KeyedExecutor(self.thread_pool)
+        self.consumer_tags: List[str] = []
+        # Messages received and not acked yet, only changed on the connection thread
+        self.in_flight = 0
         self.apm_client = apm_client
         self.verbose = verbose
+        self.verbose_max_length = verbose_max_length
+        self.sampler = sampler
         if self.apm_client:
             elasticapm.instrument()
 
@@ -77,6 +98,10 @@ class MultiThreadConsumer:
         handler_function: Callable,
         exchange_name: str = None,
         consumer_tag: str = None,
+        retry: Optional[RetryPolicy] = None,
+        dedup: Optional[DedupCache] = None,
+        partition_key: Optional[PartitionKeyFunc] = None,
+        payload_model: Optional[Type[BaseModel]] = None,
     ) -> None:
         """
         Setup queue's callback function
@@ -84,11 +109,26 @@ class MultiThreadConsumer:
         :param handler_function: target callback function
         :param exchange_name: optional, exchange that needs to blind to the queue
         :param consumer_tag: optional, human-readable tag. default value is `{host_name}-{pid}-{random-string}`
+        :param retry: optional, retry with delay when handler returns `CallbackResult(MQAction.nack, requeue=True)`
+                      or raises. Declares the delay and parking queues. Without it, nacked messages are never
+                      requeued and go to the dead letter exchange of the queue.
+        :param dedup: optional, ack redelivered messages which were processed already without calling the handler
+        :param partition_key: optional, `partition_key(header_frame, message_body)` returns the key of the message,
+                              messages with the same key are handled in order, different keys in parallel.
+                              See `header_partition_key` and `body_partition_key`.
+        :param payload_model: optional, decode the JSON body into this pydantic model and pass it to the handler
+                              as the `payload` argument. Malformed messages are nacked without requeue,
+                              so they go to the dead letter exchange of the queue.
+        Compressed bodies are decompressed by their `content_encoding` before the handler and `partition_key`.
         :return: None
         """
         self.channel.queue_declare(queue_name, durable=True)
         if exchange_name is not None:
             self.channel.queue_bind(queue_name, exchange=exchange_name, routing_key="")
+        if retry is not None:
+            for delay_queue_name, arguments in retry.delay_queues(queue_name).items():
+                self.channel.queue_declare(delay_queue_name, durable=True, arguments=arguments)
+            self.channel.queue_declare(retry.parking_queue_name(queue_name), durable=True)
 
         if consumer_tag is None:
             random_id = "".join(
@@ -100,10 +140,15 @@ class MultiThreadConsumer:
             self._handle_message,
             handler_function=handler_function,
             _queue_name=queue_name,
+            _retry=retry,
+            _dedup=dedup,
+            _partition_key=partition_key,
+            _payload_model=payload_model,
         )
         self.channel.basic_consume(
             queue_name, queue_thread_handler, consumer_tag=consumer_tag
         )
+        self.consumer_tags.append(consumer_tag)
 
     def start_consuming(self) -> None:
         """
@@ -119,12 +164,57 @@ class MultiThreadConsumer:
         self.channel.stop_consuming()
         logger.info("Stop consuming.")
 
-    def close(self) -> None:
+    def drain(self, timeout: float = 30) -> Dict[str, Any]:
+        """
+        Cancel all consumers, then process connection events until the received messages are handled
+        and their acks are sent, or `timeout` seconds. Call it after `stop_consuming`.
+        Messages not acked before the deadline are redelivered after the connection closed.
+        :return: shutdown stats
+        """
+        start = time.monotonic()
+        deadline = start + timeout
+        in_flight = self.in_flight
+        for consumer_tag in self.consumer_tags:
+            # Stops new deliveries, and requeues the ones not dispatched to the handler yet
+            self.channel.basic_cancel(consumer_tag)
+        self.consumer_tags = []
+
+        while self.in_flight > 0:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Runs the acks scheduled by add_callback_threadsafe
+            self.connection.process_data_events(time_limit=min(remaining, 0.1))
+
+        stats = {
+            "in_flight": in_flight,
+            "flushed": in_flight - self.in_flight,
+            "abandoned": self.in_flight,
+            "seconds": round(time.monotonic() - start, 3),
+        }
+        if self.in_flight:
+            logger.warning(f"Consumer drain timeout after {timeout}s, {self.in_flight} messages not acked, stats: {stats}")
+        else:
+            logger.info(f"Consumer drained, stats: {stats}")
+        return stats
+
+    def close(self, *, drain: bool = True, timeout: float = 30) -> None:
         """
         Close the consumer and handle remaining received messages.
+        :param drain: cancel consumers and send acks of the received messages before closing, see `drain`
+        :param timeout: drain timeout in seconds
         """
         logger.info("Consumer Closing... Please wait until all messages consumed.")
-        self.thread_pool.shutdown(wait=True)
+        if drain:
+            self.drain(timeout)
+        if self.in_flight and drain:
+            # Don't wait for handlers after the deadline, their messages will be redelivered
+            if sys.version_info >= (3, 9):
+                self.thread_pool.shutdown(wait=False, cancel_futures=True)
+            else:
+                self.thread_pool.shutdown(wait=False)
+        else:
+            self.thread_pool.shutdown(wait=True)
         self.connection.close()
         logger.info("Consumer Closed.")
 
@@ -135,27 +225,53 @@ class MultiThreadConsumer:
         message_body: bytes,
         handler_function: Callable,
         _queue_name: str,
+        _dedup: Optional[DedupCache] = None,
+        _payload_model: Optional[Type[BaseModel]] = None,
+        _decoded_body: Any = None,
     ) -> CallbackResult:
-        if self.apm_client:
-            if header_frame.headers and "traceparent" in header_frame.headers:
-                parent = elasticapm.trace_parent_from_string(
-                    header_frame.headers["traceparent"]
+        dedup_key = None
+        if _dedup is not None:
+            dedup_key = _dedup.message_key(header_frame.message_id, header_frame.headers, message_body)
+            if dedup_key is not None and _dedup.is_duplicate(dedup_key):
+                logger.debug(
+                    f"Skip duplicated message on Queue<{_queue_name}> with "
+                    f"delivery_tag: {method_frame.delivery_tag} key: {dedup_key}"
                 )
-                self.apm_client.begin_transaction("RabbitMQ", trace_parent=parent)
+                return CallbackResult(MQAction.ack)
+
+        handler_kwargs: Dict[str, Any] = {}
+        if _payload_model is not None:
+            try:
+                if _decoded_body is not None:
+                    handler_kwargs["payload"] = _payload_model.parse_obj(_decoded_body)
+                else:
+                    handler_kwargs["payload"] = decode_payload(message_body, _payload_model)
+            except ValueError as e:
+                logger.warning(
+                    "Reject malformed message on Queue<%s> with delivery_tag: %s, error: %s body: %s",
+                    _queue_name, method_frame.delivery_tag, e, BodyPreview(message_body, self.verbose_max_length),
+                )
+                return CallbackResult(MQAction.nack)
+
+        traced = self._start_trace(header_frame, _queue_name)
 
         callback_result: CallbackResult = handler_function(
             method_frame=method_frame,
             header_frame=header_frame,
             message_body=message_body,
+            **handler_kwargs,
         )
+        if _dedup is not None and dedup_key is not None and \
+                isinstance(callback_result, CallbackResult) and callback_result.action == MQAction.ack:
+            _dedup.mark(dedup_key)
 
-        trace_id = elasticapm.get_trace_id()
+        trace_id = elasticapm.get_trace_id() if traced else None
         logger.debug(
-            f"{callback_result.action.value.title()} message on Queue<{_queue_name}> with "
-            f"delivery_tag: {method_frame.delivery_tag} trace_id: {trace_id}"
+            "%s message on Queue<%s> with delivery_tag: %s trace_id: %s",
+            callback_result.action.value.title(), _queue_name, method_frame.delivery_tag, trace_id,
         )
 
-        if trace_id:
+        if traced:
             tran_result = (
                 "success" if callback_result.action == MQAction.ack else "failure"
             )
@@ -165,24 +281,89 @@ class MultiThreadConsumer:
 
         return callback_result
 
+    def _start_trace(self, header_frame: pika.spec.BasicProperties, _queue_name: str) -> bool:
+        """
+        Begin the APM transaction of a sampled message.
+        :return: whether a transaction is started
+        """
+        if not self.apm_client:
+            return False
+        traceparent = header_frame.headers.get("traceparent") if header_frame.headers else None
+        parent = elasticapm.trace_parent_from_string(traceparent) if traceparent else None
+        if self.sampler is not None:
+            sampled = self.sampler.is_sampled(_queue_name, parent)
+        else:
+            sampled = parent is not None and bool(parent.trace_options.recorded)
+        if not sampled:
+            return False
+        return self.apm_client.begin_transaction("RabbitMQ", trace_parent=parent) is not None
+
     def _handle_ack(
         self,
         future: Future,
         channel: Channel,
         method_frame: pika.spec.Basic.Deliver,
         _queue_name: str,
+        header_frame: Optional[pika.spec.BasicProperties] = None,
+        message_body: bytes = b"",
+        _retry: Optional[RetryPolicy] = None,
     ) -> None:
-        result = future.result()
+        self.in_flight -= 1
+        if future.cancelled():
+            # Not handled before the thread pool shut down, the message is redelivered after the connection closed
+            return
+        if _retry is None:
+            result = future.result()
+        else:
+            try:
+                result = future.result()
+            except Exception:
+                logger.exception(
+                    f"Handler failed on Queue<{_queue_name}> with delivery_tag: {method_frame.delivery_tag}"
+                )
+                result = CallbackResult(MQAction.nack, requeue=True)
         if not isinstance(result, CallbackResult):
             raise ValueError(
                 "Consumer's callback function must return a CallbackResult object."
             )
         if result.action == MQAction.ack:
             channel.basic_ack(delivery_tag=method_frame.delivery_tag)
-
+        elif result.requeue and _retry is not None:
+            self._retry_later(channel, method_frame, header_frame, message_body, _queue_name, _retry)
         else:
+            # Requeue without delay redelivers at once and spins, failed messages go to the dead letter exchange
             channel.basic_nack(delivery_tag=method_frame.delivery_tag, requeue=False)
 
+    def _retry_later(
+        self,
+        channel: Channel,
+        method_frame: pika.spec.Basic.Deliver,
+        header_frame: Optional[pika.spec.BasicProperties],
+        message_body: bytes,
+        _queue_name: str,
+        retry: RetryPolicy,
+    ) -> None:
+        """
+        Publish a copy to the delay queue, or to the parking queue after max attempts, then ack the message.
+        The copy keeps the properties, so the broker appends to its `x-death` header when it expires.
+        """
+        headers = header_frame.headers if header_frame is not None else None
+        retries = retry.retry_count(headers, _queue_name)
+        if retries + 1 >= retry.max_attempts:
+            target = retry.parking_queue_name(_queue_name)
+            logger.warning(
+                f"Park message on Queue<{_queue_name}> with delivery_tag: {method_frame.delivery_tag} "
+                f"after {retries + 1} attempts"
+            )
+        else:
+            target = retry.delay_queue_name(_queue_name, retry.delay_ms(retries))
+            logger.debug(
+                f"Retry message on Queue<{_queue_name}> with delivery_tag: {method_frame.delivery_tag} "
+                f"in {retry.delay_ms(retries)}ms, attempt {retries + 1}"
+            )
+        channel.basic_publish(exchange="", routing_key=target, body=message_body, properties=header_frame)
+        channel.basic_ack(delivery_tag=method_frame.delivery_tag)
+
     def _handle_message(
         self,
         channel: Channel,
@@ -191,19 +372,57 @@ class MultiThreadConsumer:
         message_body: bytes,
         handler_function: Callable,
         _queue_name: str,
+        _retry: Optional[RetryPolicy] = None,
+        _dedup: Optional[DedupCache] = None,
+        _partition_key: Optional[PartitionKeyFunc] = None,
+        _payload_model: Optional[Type[BaseModel]] = None,
     ) -> None:
+        # Retries republish the body as received
+        raw_body = message_body
+        try:
+            message_body = decompress(message_body, header_frame.content_encoding)
+        except Exception:
+            logger.exception(
+                f"Failed to decompress message on Queue<{_queue_name}> with delivery_tag: {method_frame.delivery_tag} "
+                f"content_encoding: {header_frame.content_encoding}, reject it"
+            )
+            channel.basic_nack(delivery_tag=method_frame.delivery_tag, requeue=False)
+            return
         if self.verbose:
             logger.debug(
-                f"received message with tag {method_frame.delivery_tag} body: {message_body.decode()}"
+                "received message with tag %s body: %s",
+                method_frame.delivery_tag, BodyPreview(message_body, self.verbose_max_length),
             )
-        future = self.thread_pool.submit(
+        decoded_body = None
+        if _partition_key is None:
+            submit: Callable[..., Future] = self.thread_pool.submit
+        else:
+            try:
+                if isinstance(_partition_key, BodyPartitionKey):
+                    # Parsed once, the payload model validates the same object
+                    decoded_body = loads(message_body)
+                    key = _partition_key.key_of(decoded_body)
+                else:
+                    key = _partition_key(header_frame, message_body)
+            except Exception:
+                logger.exception(
+                    f"Failed to get partition key on Queue<{_queue_name}> with "
+                    f"delivery_tag: {method_frame.delivery_tag}, handle without order"
+                )
+                key = None
+            submit = functools.partial(self.keyed_executor.submit, key)
+        future = submit(
             self._run_message_process,
             method_frame=method_frame,
             header_frame=header_frame,
             message_body=message_body,
             handler_function=handler_function,
             _queue_name=_queue_name,
+            _dedup=_dedup,
+            _payload_model=_payload_model,
+            _decoded_body=decoded_body,
         )
+        self.in_flight += 1
 
         # Important, add_callback_threadsafe will make sure ack event run on the same thread with the channel.
         handle_ack_callback = functools.partial(
@@ -212,6 +431,9 @@ class MultiThreadConsumer:
             channel=channel,
             method_frame=method_frame,
             _queue_name=_queue_name,
+            header_frame=header_frame,
+            message_body=raw_body,
+            _retry=_retry,
         )
         future.add_done_callback(
             lambda x: self.connection.add_callback_threadsafe(handle_ack_callback)
@@ -0,0 +1,214 @@
+import datetime
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import elasticapm
+from sqlalchemy import INTEGER, TEXT, Column, DateTime, Integer, String
+from sqlalchemy.orm import Session
+
+from yodo1.sqlalchemy import BaseDBModel
+
+from .http_client import RabbitHttpSender
+
+logger = logging.getLogger("yodo1.rabbitmq")
+
+
+class OutboxMessage(BaseDBModel):
+    """
+    Message waiting to be published by `OutboxRelay`.
+    Add it in the same session as the business data, so both are committed or rolled back together.
+    """
+    __tablename__ = "mq_outbox"
+    __table_args__ = {"extend_existing": True}
+
+    id = Column(INTEGER, primary_key=True, autoincrement=True, nullable=False)
+    exchange_name = Column(String(255), nullable=False)
+    routing_key = Column(String(255), nullable=False, default="")
+    event_name = Column(String(255), nullable=True)
+    payload = Column(TEXT, nullable=False, comment="JSON message body")
+    properties = Column(TEXT, nullable=True, comment="JSON message properties")
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(TEXT, nullable=True)
+    available_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow, index=True)
+    sent_at = Column(DateTime, nullable=True, index=True)
+
+    @classmethod
+    def add(cls,
+            session: Session,
+            *,
+            exchange_name: str,
+            message_body: Dict,
+            routing_key: str = "",
+            event_name: Optional[str] = None,
+            properties: Optional[Dict] = None) -> "OutboxMessage":
+        """
+        Add a message to the session, it is published after the session commits.
+        Keeps the current APM trace parent in the headers, the relay uses it as the parent of the publish transaction,
+        so the consumer is correlated with this request.
+        """
+        traceparent = elasticapm.get_trace_parent_header()
+        if traceparent:
+            properties = dict(properties or {})
+            properties["headers"] = {**properties.get("headers", {}), "traceparent": traceparent}
+        message = cls(
+            exchange_name=exchange_name,
+            routing_key=routing_key,
+            event_name=event_name,
+            payload=json.dumps(message_body),
+            properties=json.dumps(properties) if properties else None,
+        )
+        session.add(message)
+        return message
+
+
+class OutboxRelay:
+    def __init__(self,
+                 db: Any,
+                 sender: RabbitHttpSender,
+                 *,
+                 batch_size: int = 100,
+                 concurrency: int = 8,
+                 poll_interval: float = 1,
+                 max_backoff: float = 300) -> None:
+        """
+        Publish outbox messages in the background.
+        Each batch reads unsent rows with `SELECT ... FOR UPDATE SKIP LOCKED`, so several relays can run
+        at the same time without sending a row twice. Rows are published in parallel with `concurrency` threads,
+        set it to 1 to keep the order. Failed rows are retried later with exponential backoff.
+
+        :param db: DBManager
+        :param sender: RabbitHttpSender
+        :param batch_size: rows per batch
+        :param concurrency: parallel publish requests
+        :param poll_interval: seconds to wait when there is no more row to send
+        :param max_backoff: max seconds to wait before retrying a failed row
+        """
+        self.db = db
+        self.sender = sender
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.sent = 0
+        self.failed = 0
+        self._executor = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _publish(self, message: OutboxMessage) -> Optional[Exception]:
+        try:
+            self.sender.publish(
+                exchange_name=message.exchange_name,
+                message_body=json.loads(message.payload),
+                routing_key=message.routing_key,
+                event_name=message.event_name,
+                properties=json.loads(message.properties) if message.properties else None,
+                # The relay retries the row with backoff
+                max_retry=1,
+            )
+        except Exception as e:
+            return e
+        return None
+
+    def relay_once(self) -> int:
+        """
+        Publish one batch.
+        :return: handled row count, sent or failed
+        """
+        now = datetime.datetime.utcnow()
+        session = self.db.SessionLocal()
+        try:
+            messages: List[OutboxMessage] = session.query(OutboxMessage) \
+                .filter(OutboxMessage.sent_at.is_(None), OutboxMessage.available_at <= now) \
+                .order_by(OutboxMessage.id) \
+                .limit(self.batch_size) \
+                .with_for_update(skip_locked=True) \
+                .all()
+            if not messages:
+                session.rollback()
+                return 0
+
+            if self._executor is None:
+                errors = [self._publish(message) for message in messages]
+            else:
+                errors = list(self._executor.map(self._publish, messages))
+
+            sent_at = datetime.datetime.utcnow()
+            for message, error in zip(messages, errors):
+                if error is None:
+                    message.sent_at = sent_at
+                    self.sent += 1
+                else:
+                    message.attempts += 1
+                    message.last_error = repr(error)
+                    backoff = min(2 ** message.attempts, self.max_backoff)
+                    message.available_at = sent_at + datetime.timedelta(seconds=backoff)
+                    self.failed += 1
+                    logger.warning(f"Failed to relay outbox message {message.id} to exchange: {message.exchange_name}, "
+                                   f"attempts: {message.attempts}, retry in {backoff}s, error: {error!r}")
+            session.commit()
+            return len(messages)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def run(self) -> None:
+        """
+        Relay until `stop` is called, blocks current thread.
+        """
+        logger.info("Outbox relay started.")
+        while not self._stop_event.is_set():
+            try:
+                handled = self.relay_once()
+            except Exception:
+                logger.exception("Outbox relay batch failed")
+                handled = 0
+            if handled < self.batch_size:
+                self._stop_event.wait(self.poll_interval)
+        logger.info(f"Outbox relay stopped, sent: {self.sent} failed: {self.failed}")
+
+    def start(self) -> None:
+        """
+        Relay on a daemon thread.
+        """
+        self._stop_event.clear()
+        if self._executor is None and self.concurrency > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._thread = threading.Thread(target=self.run, name="outbox-relay", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def purge_sent(self, older_than: float = 7 * 86400) -> int:
+        """
+        Delete sent rows older than `older_than` seconds.
+        :return: deleted row count
+        """
+        before = datetime.datetime.utcnow() - datetime.timedelta(seconds=older_than)
+        session = self.db.SessionLocal()
+        try:
+            count = session.query(OutboxMessage) \
+                .filter(OutboxMessage.sent_at.isnot(None), OutboxMessage.sent_at < before) \
+                .delete(synchronize_session=False)
+            session.commit()
+            return count
+        finally:
+            session.close()
+
+
+__all__ = [
+    'OutboxMessage',
+    'OutboxRelay',
+]
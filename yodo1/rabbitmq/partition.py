@@ -0,0 +1,142 @@
+import collections
+import logging
+import threading
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+import pika
+
+from .payload import loads
+
+logger = logging.getLogger("yodo1.rabbitmq")
+
+PartitionKeyFunc = Callable[[pika.spec.BasicProperties, bytes], Optional[Hashable]]
+
+
+def header_partition_key(name: str) -> PartitionKeyFunc:
+    """
+    Partition messages by a header value.
+    """
+    def key(header_frame: pika.spec.BasicProperties, message_body: bytes) -> Optional[Hashable]:
+        headers = header_frame.headers
+        return headers.get(name) if headers else None
+    return key
+
+
+class BodyPartitionKey:
+    def __init__(self, field: str) -> None:
+        """
+        Partition key from a field of the JSON object body, created by `body_partition_key`.
+        Consumers which decode the body anyway call `key_of` with the decoded body instead of calling it.
+        """
+        self.field = field
+
+    def key_of(self, body: Any) -> Optional[Hashable]:
+        return body.get(self.field) if isinstance(body, dict) else None
+
+    def __call__(self, header_frame: pika.spec.BasicProperties, message_body: bytes) -> Optional[Hashable]:
+        return self.key_of(loads(message_body))
+
+
+def body_partition_key(field: str) -> PartitionKeyFunc:
+    """
+    Partition messages by a field of the JSON object body.
+    `MultiThreadConsumer` passes the decoded body on to its `payload_model`, so the body is parsed once.
+    """
+    return BodyPartitionKey(field)
+
+
+_Task = Tuple[Future, Callable, Tuple, Dict[str, Any]]
+
+
+class KeyedExecutor:
+    def __init__(self, executor: Executor) -> None:
+        """
+        Run tasks with the same key one by one in submit order, tasks with different keys run in parallel
+        on `executor`. Each key has a lane of pending tasks, the next one is submitted when the previous one is done,
+        so a busy key doesn't hold a worker thread and other keys take turns.
+        After `executor` is shut down, `submit` raises `RuntimeError` like `Executor.submit`
+        and the tasks waiting in the lanes are cancelled.
+        """
+        self.executor = executor
+        self._lanes: Dict[Hashable, Deque[_Task]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """
+        Tasks waiting behind another task with the same key.
+        """
+        with self._lock:
+            return sum(len(lane) for lane in self._lanes.values())
+
+    @property
+    def active_keys(self) -> int:
+        with self._lock:
+            return len(self._lanes)
+
+    def submit(self, key: Optional[Hashable], fn: Callable, *args: Any, **kwargs: Any) -> Future:
+        """
+        Submit a task, tasks without key are not ordered.
+        :raise RuntimeError: the executor is shut down
+        """
+        if key is None:
+            return self.executor.submit(fn, *args, **kwargs)
+        future: Future = Future()
+        task = (future, fn, args, kwargs)
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is not None:
+                lane.append(task)
+                return future
+            self._lanes[key] = collections.deque()
+        try:
+            self._submit_task(key, task)
+        except RuntimeError:
+            self._cancel_lane(key, task)
+            raise
+        return future
+
+    def _submit_task(self, key: Hashable, task: _Task) -> None:
+        scheduled = self.executor.submit(self._run, key, task)
+        # `shutdown(cancel_futures=True)` cancels the scheduled run before it starts
+        scheduled.add_done_callback(lambda f: self._cancel_lane(key, task) if f.cancelled() else None)
+
+    def _cancel_lane(self, key: Hashable, task: _Task) -> None:
+        """
+        Cancel a task which can't be scheduled and the tasks behind it, don't run them on the calling thread.
+        """
+        with self._lock:
+            lane = self._lanes.pop(key, collections.deque())
+        if lane:
+            logger.warning(f"Executor is shut down, cancel {len(lane) + 1} tasks with partition key {key!r}")
+        for future, _, _, _ in [task, *lane]:
+            future.cancel()
+
+    def _run(self, key: Hashable, task: _Task) -> None:
+        future, fn, args, kwargs = task
+        if future.set_running_or_notify_cancel():
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+        with self._lock:
+            lane = self._lanes[key]
+            if not lane:
+                del self._lanes[key]
+                return
+            next_task = lane.popleft()
+        try:
+            self._submit_task(key, next_task)
+        except RuntimeError:
+            self._cancel_lane(key, next_task)
+
+
+__all__ = [
+    'BodyPartitionKey',
+    'KeyedExecutor',
+    'body_partition_key',
+    'header_partition_key',
+]
@@ -0,0 +1,49 @@
+import json
+from typing import Any, Type, TypeVar
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+T = TypeVar("T", bound=BaseModel)
+
+
+def loads(body: bytes) -> Any:
+    """
+    Decode a JSON message body, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def decode_payload(body: bytes, model: Type[T]) -> T:
+    """
+    Decode a JSON message body into `model`.
+    :raise ValueError: malformed JSON or the payload doesn't match the model, pydantic `ValidationError` included
+    """
+    return model.parse_obj(loads(body))
+
+
+class BodyPreview:
+    def __init__(self, body: bytes, max_length: int = 1024) -> None:
+        """
+        Message body for logging, only decoded and truncated when the record is formatted.
+        """
+        self.body = body
+        self.max_length = max_length
+
+    def __str__(self) -> str:
+        if len(self.body) <= self.max_length:
+            return self.body.decode(errors="replace")
+        return f"{self.body[:self.max_length].decode(errors='replace')}...({len(self.body)} bytes)"
+
+
+__all__ = [
+    'BodyPreview',
+    'decode_payload',
+    'loads',
+]
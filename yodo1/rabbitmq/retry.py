@@ -0,0 +1,88 @@
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+
+logger = logging.getLogger("yodo1.rabbitmq")
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        *,
+        max_attempts: int = 5,
+        delays: Optional[Sequence[float]] = None,
+        base_delay: float = 1,
+        multiplier: float = 2,
+        max_delay: float = 300,
+    ) -> None:
+        """
+        Delayed retry with exponential backoff, failed messages wait in a delay queue with TTL,
+        then dead-letter back to the work queue. After `max_attempts` they go to the parking queue.
+
+        Topology of queue `q`:
+        - `q.retry.<delay_ms>` delay queues, `x-message-ttl` is the delay and the dead-letter target is `q`
+        - `q.parking` keeps the messages which failed `max_attempts` times
+
+        :param max_attempts: total delivery attempts, including the first one
+        :param delays: delay in seconds before each retry, the last one is reused. Overrides the backoff params
+        :param base_delay: delay before the first retry in seconds
+        :param multiplier: delay multiplier of the next retry
+        :param max_delay: max delay in seconds
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        if delays is None:
+            delays = [min(base_delay * multiplier ** retry, max_delay) for retry in range(max(max_attempts - 1, 1))]
+        if not delays:
+            raise ValueError("delays must not be empty")
+        self.delays_ms: List[int] = [int(delay * 1000) for delay in delays]
+
+    def delay_ms(self, retries: int) -> int:
+        """
+        Delay before the retry after `retries` retries already happened.
+        """
+        return self.delays_ms[min(retries, len(self.delays_ms) - 1)]
+
+    @staticmethod
+    def delay_queue_name(queue_name: str, delay_ms: int) -> str:
+        # Queue arguments can't change after declared, so the delay is part of the name
+        return f"{queue_name}.retry.{delay_ms}"
+
+    @staticmethod
+    def parking_queue_name(queue_name: str) -> str:
+        return f"{queue_name}.parking"
+
+    def delay_queues(self, queue_name: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Delay queue names and their arguments.
+        """
+        return {
+            self.delay_queue_name(queue_name, delay_ms): {
+                "x-message-ttl": delay_ms,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": queue_name,
+            }
+            for delay_ms in sorted(set(self.delays_ms))
+        }
+
+    @staticmethod
+    def retry_count(headers: Optional[Dict[str, Any]], queue_name: str) -> int:
+        """
+        Retries already happened, counted from the `x-death` entries of the delay queues.
+        """
+        if not headers:
+            return 0
+        prefix = f"{queue_name}.retry."
+        count = 0
+        for death in headers.get("x-death") or []:
+            name = death.get("queue", "")
+            if isinstance(name, bytes):
+                name = name.decode()
+            if name.startswith(prefix) and death.get("reason") in ("expired", b"expired"):
+                count += int(death.get("count", 1))
+        return count
+
+
+__all__ = [
+    'RetryPolicy',
+]
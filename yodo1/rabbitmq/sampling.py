@@ -0,0 +1,56 @@
+import random
+from typing import Callable, Dict, Optional
+
+from elasticapm.utils.disttracing import TraceParent
+
+
+class TraceSampler:
+    def __init__(self,
+                 rate: float = 1.0,
+                 *,
+                 rates: Optional[Dict[str, float]] = None,
+                 honor_parent: bool = True,
+                 random_func: Callable[[], float] = random.random) -> None:
+        """
+        Decide which messages start an APM transaction, not sampled messages skip the transaction entirely.
+
+        :param rate: default sample rate from 0 to 1
+        :param rates: sample rate per exchange name for the sender, per queue name for the consumer
+        :param honor_parent: follow the sampled flag of the upstream `traceparent` when there is one,
+                             so a trace is either fully recorded or not at all
+        :param random_func: random number generator, for testing
+        """
+        self.rate = rate
+        self.rates = rates or {}
+        for value in [rate, *self.rates.values()]:
+            if not 0 <= value <= 1:
+                raise ValueError(f"Sample rate must be between 0 and 1, got {value}")
+        self.honor_parent = honor_parent
+        self._random = random_func
+
+    def rate_of(self, name: Optional[str]) -> float:
+        if name is None:
+            return self.rate
+        return self.rates.get(name, self.rate)
+
+    def is_sampled(self, name: Optional[str], trace_parent: Optional[TraceParent] = None) -> bool:
+        if trace_parent is not None and self.honor_parent:
+            return bool(trace_parent.trace_options.recorded)
+        rate = self.rate_of(name)
+        if rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        return self._random() < rate
+
+    @staticmethod
+    def unsampled_header() -> str:
+        """
+        A new `traceparent` with the sampled flag off, passes the decision to the consumers.
+        """
+        return f"00-{random.getrandbits(128):032x}-{random.getrandbits(64):016x}-00"
+
+
+__all__ = [
+    'TraceSampler',
+]
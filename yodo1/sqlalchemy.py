@@ -1,15 +1,26 @@
+import base64
 import datetime
-from typing import Dict, Any, List, TypeVar, Type, Iterator
+import functools
+import itertools
+import json
+import logging
+import threading
+import time
+from typing import Dict, Any, List, TypeVar, Type, Iterator, Generic, Optional, Sequence, Tuple, Hashable, Set
 
-from sqlalchemy import Column, DateTime
+from sqlalchemy import Column, DateTime, and_, or_, select, event, inspect, text
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import sessionmaker, Session, Query, make_transient_to_detached, object_session
 from sqlalchemy.schema import CreateTable
 from sqlalchemy.sql import func
+from sqlalchemy.sql.dml import Delete, Insert, Update
+
+from yodo1.cache import TTLCache
 
 T = TypeVar("T")
 Base = declarative_base()  # type: ignore
+logger = logging.getLogger("yodo1.sqlalchemy")
 
 
 @compiles(CreateTable)
@@ -22,6 +33,168 @@ def _compile_create_table(element: Any, compiler: Any, **kwargs: Dict) -> str:
     return compiler.visit_create_table(element)
 
 
+class InvalidCursorException(ValueError):
+    pass
+
+
+class KeysetPage(Generic[T]):
+    def __init__(self, items: List[T], *, next_cursor: Optional[str], has_more: bool):
+        """
+        One page of a keyset pagination result, can be returned directly with `CursorPageSchema` response models.
+        :param items: models in current page
+        :param next_cursor: opaque token for the next page, None when there is no more data
+        :param has_more: whether there are more rows after this page
+        """
+        self.items = items
+        self.next_cursor = next_cursor
+        self.has_more = has_more
+
+
+def _encode_cursor_value(value: Any) -> Any:
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def _decode_cursor_value(column: Column, value: Any) -> Any:
+    if value is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is datetime.datetime:
+        return datetime.datetime.fromisoformat(value)
+    if python_type is datetime.date:
+        return datetime.date.fromisoformat(value)
+    return value
+
+
+def encode_cursor(keys: Sequence[str], values: Sequence[Any]) -> str:
+    """
+    Encode ordering columns and the values of the last row into an url-safe opaque token.
+    """
+    raw = json.dumps({'k': list(keys), 'v': [_encode_cursor_value(v) for v in values]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, keys: Sequence[str]) -> List[Any]:
+    """
+    Decode the token generated by `encode_cursor`, raise InvalidCursorException if token is broken
+    or generated with another ordering.
+    """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        cursor_keys, values = data['k'], data['v']
+    except Exception:
+        raise InvalidCursorException('Invalid cursor')
+    if list(cursor_keys) != list(keys) or len(values) != len(keys):
+        raise InvalidCursorException('Cursor does not match the ordering columns')
+    return values
+
+
+class ModelCache:
+    def __init__(self, model: Any, *, ttl: float = 60, max_size: int = 1024) -> None:
+        """
+        Per model read-through cache, enable it with `Model.enable_cache()`.
+        Rows changed by `after_insert`, `after_update` and `after_delete` events in the same process are invalidated
+        on flush and again when the session commits or rolls back, so entries cached from the old row before
+        the commit, or from the uncommitted row before a rollback, are dropped.
+        Changes from other processes or bulk `query.update()` are only picked up after `ttl` seconds.
+        :param model: BaseDBModel subclass
+        :param ttl: seconds before an entry expires
+        :param max_size: max entry count, least recently used entry will be evicted when full
+        """
+        self.model = model
+        self._cache = TTLCache(max_size=max_size, ttl=ttl, on_evict=self._on_evict)
+        # primary key -> cache keys, used to invalidate all lookups pointing to the same row
+        self._pk_keys: Dict[Tuple, Set[Hashable]] = {}
+        # cache keys of lookups without result, invalidated on any change
+        self._missing_keys: Set[Hashable] = set()
+
+        for event_name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(model, event_name, self._on_change)
+
+    @property
+    def hits(self) -> int:
+        return self._cache.hits
+
+    @property
+    def misses(self) -> int:
+        return self._cache.misses
+
+    @staticmethod
+    def make_key(kwargs: Dict[str, Any]) -> Hashable:
+        return tuple(sorted(kwargs.items()))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get cached row, return `(primary_key, row_dict)`, row_dict is None when the row does not exist
+        """
+        return self._cache.get(key, default)
+
+    def set(self, key: Hashable, pk: Optional[Tuple], data: Optional[Dict[str, Any]]) -> None:
+        with self._cache.lock:
+            self._cache.set(key, (pk, data))
+            if pk is None:
+                self._missing_keys.add(key)
+            else:
+                self._pk_keys.setdefault(pk, set()).add(key)
+
+    def invalidate(self, pk: Tuple) -> None:
+        with self._cache.lock:
+            for key in self._pk_keys.pop(pk, ()):
+                self._cache.pop(key)
+            for key in list(self._missing_keys):
+                self._cache.pop(key)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def _on_evict(self, key: Hashable, value: Tuple) -> None:
+        # Called by TTLCache with its lock held
+        pk = value[0]
+        if pk is None:
+            self._missing_keys.discard(key)
+        else:
+            keys = self._pk_keys.get(pk)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    self._pk_keys.pop(pk, None)
+
+    def _on_change(self, mapper: Any, connection: Any, target: Any) -> None:
+        pk = tuple(mapper.primary_key_from_instance(target))
+        self.invalidate(pk)
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault(_PENDING_INVALIDATIONS, set()).add((self, pk))
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+_PENDING_INVALIDATIONS = 'yodo1_model_cache_pending'
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session: Session) -> None:
+    for cache, pk in session.info.pop(_PENDING_INVALIDATIONS, ()):
+        cache.invalidate(pk)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _invalidate_rolled_back(session: Session, previous_transaction: Any) -> None:
+    # A savepoint rollback keeps the changes flushed before it, they are invalidated again on commit
+    if previous_transaction.parent is None:
+        pending = session.info.pop(_PENDING_INVALIDATIONS, ())
+    else:
+        pending = session.info.get(_PENDING_INVALIDATIONS, ())
+    for cache, pk in list(pending):
+        cache.invalidate(pk)
+
+
 class BaseDBModel(Base):  # type: ignore
     __abstract__ = True
 
@@ -41,24 +214,205 @@ class BaseDBModel(Base):  # type: ignore
     def is_saved(self) -> bool:
         return self.created_at is not None
 
+    @classmethod
+    def column_names(cls) -> Tuple[str, ...]:
+        """
+        Column names of the table, cached per model class.
+        """
+        # Check cls.__dict__, otherwise subclass will get the parent's cache
+        names = cls.__dict__.get('_column_names_cache')
+        if names is None:
+            names = tuple(c.name for c in cls.__table__.columns)
+            setattr(cls, '_column_names_cache', names)
+        return names
+
     def to_dict(self, target_cols: List[str] = None) -> Dict[str, Any]:
         if target_cols is None:
-            target_cols = [c.name for c in self.__table__.columns]
+            target_cols = self.column_names()
         return {
             col: getattr(self, col, None)
             for col in target_cols
         }
 
+    @classmethod
+    def project(cls,
+                session: Session,
+                columns: Optional[Sequence[str]] = None,
+                *,
+                where: Sequence[Any] = (),
+                order_by: Sequence[Any] = (),
+                limit: Optional[int] = None,
+                offset: Optional[int] = None,
+                as_dict: bool = True) -> List[Any]:
+        """
+        Select only the target columns with a Core `select`, skip ORM hydration and identity map.
+        Useful for read-only list endpoints, result can be returned with `BaseSchema` response models.
+        :param session: db session
+        :param columns: column names, default is all columns
+        :param where: filter expressions, like `[ItemModel.id > 10]`
+        :param order_by: order by expressions
+        :param limit: limit
+        :param offset: offset
+        :param as_dict: return dict rows, otherwise return named tuple rows
+        :return: list of rows
+        """
+        if columns is None:
+            columns = cls.column_names()
+        table_columns = cls.__table__.columns
+        stmt = select([table_columns[name] for name in columns])
+        if where:
+            stmt = stmt.where(and_(*where))
+        if order_by:
+            stmt = stmt.order_by(*order_by)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        if offset is not None:
+            stmt = stmt.offset(offset)
+        result = session.execute(stmt)
+        if not as_dict:
+            return result.fetchall()
+        keys = list(result.keys())
+        return [dict(zip(keys, row)) for row in result]
+
     @classmethod
     def instance(cls: Type[T], session: Session, **kwargs) -> T:  # type: ignore  # noqa: F821
         """
-        Get instance from db or create a new one
+        Get instance from db or create a new one.
+        When cache is enabled, cached row is merged into the session without a db round trip.
         """
-        model = session.query(cls).filter_by(**kwargs).first()
+        model = None
+        if cls.model_cache() is not None:  # type: ignore
+            cached = cls.cached_get(session, **kwargs)  # type: ignore
+            if cached is not None:
+                model = session.merge(cached, load=False)
+        else:
+            model = session.query(cls).filter_by(**kwargs).first()
         if not model:
             model = cls(**kwargs)  # type: ignore
         return model
 
+    @classmethod
+    def enable_cache(cls, *, ttl: float = 60, max_size: int = 1024) -> ModelCache:
+        """
+        Enable read-through cache for `cached_get` and `instance` on this model.
+        Only suitable for reference data which is rarely changed, see `ModelCache`.
+        :param ttl: seconds before an entry expires
+        :param max_size: max entry count
+        :return: ModelCache
+        """
+        cache = cls.model_cache()
+        if cache is None:
+            cache = ModelCache(cls, ttl=ttl, max_size=max_size)
+            setattr(cls, '_model_cache', cache)
+        return cache
+
+    @classmethod
+    def model_cache(cls) -> Optional[ModelCache]:
+        return cls.__dict__.get('_model_cache')
+
+    @classmethod
+    def cached_get(cls, session: Session, *, as_dict: bool = False, **kwargs: Any) -> Any:
+        """
+        Get one row by primary key or unique key, like `session.query(cls).filter_by(**kwargs).first()`.
+        Cache hit will not touch the db, and return a detached model (or a dict with `as_dict=True`).
+        :param session: db session, only used on cache miss
+        :param as_dict: return row dict instead of model
+        :return: model, dict or None
+        """
+        cache = cls.model_cache()
+        if cache is None:
+            model = session.query(cls).filter_by(**kwargs).first()
+            if model is None or not as_dict:
+                return model
+            return model.to_dict()
+
+        key = cache.make_key(kwargs)
+        cached = cache.get(key)
+        if cached is None:
+            model = session.query(cls).filter_by(**kwargs).first()
+            if model is None:
+                cache.set(key, None, None)
+                return None
+            data = model.to_dict()
+            cache.set(key, inspect(model).identity, data)
+            return dict(data) if as_dict else model
+
+        data = cached[1]
+        if data is None:
+            return None
+        if as_dict:
+            return dict(data)
+        model = cls(**data)
+        make_transient_to_detached(model)
+        return model
+
+    @classmethod
+    def _keyset_columns(cls, order_by: Optional[Sequence[str]]) -> Tuple[str, ...]:
+        if order_by is None:
+            order_by = ('created_at', 'id') if 'id' in cls.__table__.columns else ('created_at',)
+        keys = list(order_by)
+        # Append primary keys as tie breaker, so the ordering is always unique
+        for pk in cls.__table__.primary_key.columns:
+            if pk.name not in keys:
+                keys.append(pk.name)
+        return tuple(keys)
+
+    @classmethod
+    def paginate(cls,
+                 session: Session,
+                 *,
+                 limit: int = 20,
+                 cursor: Optional[str] = None,
+                 order_by: Optional[Sequence[str]] = None,
+                 desc: bool = False,
+                 query: Optional[Query] = None) -> KeysetPage:
+        """
+        Keyset (seek) pagination, every page costs the same no matter how deep it is,
+        as long as there is an index on the ordering columns.
+        :param session: db session
+        :param limit: page size
+        :param cursor: `next_cursor` from previous page, None for the first page
+        :param order_by: ordering column names, default is (created_at, id). Primary keys are appended as tie breaker.
+                         Ordering columns must not be nullable.
+        :param desc: order descending
+        :param query: optional base query with custom filters, default is `session.query(cls)`
+        :return: KeysetPage
+        """
+        if limit < 1:
+            raise ValueError('limit must be at least 1')
+        keys = cls._keyset_columns(order_by)
+        columns = [getattr(cls, key) for key in keys]
+
+        if query is None:
+            query = session.query(cls)
+
+        if cursor is not None:
+            raw_values = decode_cursor(cursor, keys)
+            try:
+                values = [_decode_cursor_value(cls.__table__.columns[key], value)
+                          for key, value in zip(keys, raw_values)]
+            except (TypeError, ValueError):
+                raise InvalidCursorException('Invalid cursor value')
+            # Expand (a, b) > (x, y) into a >= x AND ((a > x) OR (a = x AND b > y)),
+            # the leading range on the first column lets both MySQL and SQLite seek on the index.
+            conditions = []
+            for index, column in enumerate(columns):
+                seek = column < values[index] if desc else column > values[index]
+                conditions.append(and_(*[columns[i] == values[i] for i in range(index)], seek))
+            leading = columns[0] <= values[0] if desc else columns[0] >= values[0]
+            query = query.filter(leading, or_(*conditions))
+
+        query = query.order_by(*[column.desc() if desc else column.asc() for column in columns])
+        items = query.limit(limit + 1).all()
+
+        has_more = len(items) > limit
+        items = items[:limit]
+        next_cursor = None
+        if has_more:
+            last = items[-1]
+            next_cursor = encode_cursor(keys, [getattr(last, key) for key in keys])
+        return KeysetPage(items, next_cursor=next_cursor, has_more=has_more)
+
     @classmethod
     def time_now(cls) -> datetime.datetime:
         return datetime.datetime.utcnow()
@@ -68,10 +422,134 @@ class BaseDBModel(Base):  # type: ignore
         return datetime.datetime.utcnow() + datetime.timedelta(seconds=seconds)
 
 
+class Replica:
+    def __init__(self, engine: Any) -> None:
+        self.engine = engine
+        self.active: int = 0
+        self.ejected_until: float = 0
+        self._lock = threading.Lock()
+
+    def is_healthy(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def acquire(self) -> None:
+        with self._lock:
+            self.active += 1
+
+    def release(self) -> None:
+        with self._lock:
+            self.active -= 1
+
+
+class RoutingSession(Session):
+    def __init__(self, *, replica: Optional[Replica] = None, **kwargs: Any) -> None:
+        """
+        Session for read-heavy usage, queries go to the replica, flushes and DML statements go to the primary bind.
+        After a flush or DML statement, the session reads from the primary until commit or rollback,
+        so it can read back its own uncommitted writes.
+        Raw sql with `session.execute(text(...))` goes to the replica before any write, don't write with it.
+        """
+        super().__init__(**kwargs)
+        self.replica = replica
+        self._released = replica is None
+        self.use_primary = False
+
+    def get_bind(self, mapper: Any = None, clause: Any = None, **kwargs: Any) -> Any:
+        if isinstance(clause, (Insert, Update, Delete)):
+            self.use_primary = True
+        if self.replica is None or self.use_primary:
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        return self.replica.engine
+
+    def close(self) -> None:
+        super().close()
+        if not self._released:
+            self._released = True
+            self.replica.release()
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _stick_to_primary(session: RoutingSession, flush_context: Any, instances: Any) -> None:
+    session.use_primary = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _unstick_from_primary(session: RoutingSession, *args: Any) -> None:
+    session.use_primary = False
+
+
 class DBManager:
-    def __init__(self, engine: Any):
+    def __init__(self,
+                 engine: Any,
+                 *,
+                 replica_engines: Sequence[Any] = (),
+                 replica_strategy: str = 'round_robin',
+                 eject_seconds: float = 30):
+        """
+        :param engine: primary engine
+        :param replica_engines: optional read replica engines, used by `read_session` and `get_read_session`
+        :param replica_strategy: `round_robin` or `least_connections`
+        :param eject_seconds: seconds to skip a replica after a connection error
+        """
+        if replica_strategy not in ('round_robin', 'least_connections'):
+            raise ValueError(f'Unknown replica strategy: {replica_strategy}')
         self.engine = engine
         self._SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        self._ReadSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
+
+        self.replicas = [Replica(replica_engine) for replica_engine in replica_engines]
+        self.replica_strategy = replica_strategy
+        self.eject_seconds = eject_seconds
+        self._round_robin = itertools.count()
+        self._lock = threading.Lock()
+        for replica in self.replicas:
+            event.listen(replica.engine, 'handle_error', functools.partial(self._on_replica_error, replica))
+
+    def _on_replica_error(self, replica: Replica, context: Any) -> None:
+        # Query errors like deadlocks or timeouts don't mean the replica is down
+        if context.is_disconnect or context.connection is None:
+            self.eject_replica(replica)
+
+    def eject_replica(self, replica: Replica) -> None:
+        """
+        Skip the replica for `eject_seconds`
+        """
+        replica.ejected_until = time.monotonic() + self.eject_seconds
+        logger.warning(f"Replica {replica.engine.url!r} ejected for {self.eject_seconds} seconds")
+
+    def check_replicas(self) -> List[Replica]:
+        """
+        Ping every replica with `SELECT 1`, eject failed ones and restore recovered ones.
+        Call it periodically to find broken replicas before requests do.
+        :return: healthy replicas
+        """
+        healthy = []
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    conn.execute(text('SELECT 1'))
+            except Exception:
+                self.eject_replica(replica)
+            else:
+                replica.ejected_until = 0
+                healthy.append(replica)
+        return healthy
+
+    def _choose_replica(self) -> Optional[Replica]:
+        now = time.monotonic()
+        healthy = [replica for replica in self.replicas if replica.is_healthy(now)]
+        if not healthy:
+            if self.replicas:
+                logger.warning("No healthy replica, read from the primary")
+            return None
+        with self._lock:
+            if self.replica_strategy == 'least_connections':
+                replica = min(healthy, key=lambda r: r.active)
+            else:
+                replica = healthy[next(self._round_robin) % len(healthy)]
+            replica.acquire()
+        return replica
 
     def get_session(self) -> Iterator[Session]:
         db = None
@@ -88,9 +566,31 @@ class DBManager:
     def session(self) -> Session:
         return self.SessionLocal()
 
+    def ReadSessionLocal(self) -> Session:
+        """
+        Create a session which reads from a replica, fallback to the primary when there is no healthy replica.
+        """
+        return self._ReadSessionLocal(replica=self._choose_replica())
+
+    def read_session(self) -> Session:
+        return self.ReadSessionLocal()
+
+    def get_read_session(self) -> Iterator[Session]:
+        db = None
+        try:
+            db = self.ReadSessionLocal()
+            yield db
+        finally:
+            if db:
+                db.close()
+
 
 __all__ = [
     'Base',
     'BaseDBModel',
-    'DBManager'
+    'DBManager',
+    'KeysetPage',
+    'ModelCache',
+    'RoutingSession',
+    'InvalidCursorException',
 ]
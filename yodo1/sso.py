@@ -12,6 +12,8 @@ from pydantic import BaseModel, Field
 from starlette.status import HTTP_401_UNAUTHORIZED
 import elasticapm
 
+from yodo1.timing import timing_phase
+
 
 class HTTPBearerWithCookie(HTTPBearer):
     def __init__(
@@ -128,15 +130,16 @@ class JWTHelper:
         return token_str
 
     def decode_token(self, token: str) -> JWTPayload:
-        if self.public_key_url:
-            self.public_key = self._fetch_public_key(url=self.public_key_url)
-        try:
-            payload = jwt.decode(token, self.public_key, algorithms=['RS256'])
-            return JWTPayload(**payload)
-        except jwt.ExpiredSignatureError:
-            raise HTTPException(status_code=401, detail='Token expired')
-        except jwt.InvalidTokenError:
-            raise HTTPException(status_code=401, detail='Invalid token')
+        with timing_phase('auth'):
+            if self.public_key_url:
+                self.public_key = self._fetch_public_key(url=self.public_key_url)
+            try:
+                payload = jwt.decode(token, self.public_key, algorithms=['RS256'])
+                return JWTPayload(**payload)
+            except jwt.ExpiredSignatureError:
+                raise HTTPException(status_code=401, detail='Token expired')
+            except jwt.InvalidTokenError:
+                raise HTTPException(status_code=401, detail='Invalid token')
 
     def current_payload(self,
                         credentials: HTTPAuthorizationCredentials = Security(HTTPBearerWithCookie())
@@ -0,0 +1,319 @@
+import asyncio
+import bisect
+import contextlib
+import cProfile
+import functools
+import io
+import itertools
+import logging
+import os
+import pstats
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Sequence
+
+from fastapi.routing import APIRoute
+
+logger = logging.getLogger("yodo1.timing")
+
+# Milliseconds
+DEFAULT_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class RequestTiming:
+    def __init__(self) -> None:
+        """
+        Time spent on each phase of current request, in seconds.
+        """
+        self.start_at = time.perf_counter()
+        self.endpoint_end_at: Optional[float] = None
+        self.phases: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+
+_current_timing: ContextVar[Optional[RequestTiming]] = ContextVar("yodo1_request_timing", default=None)
+
+
+def current_timing() -> Optional[RequestTiming]:
+    return _current_timing.get()
+
+
+@contextlib.contextmanager
+def timing_phase(name: str) -> Iterator[None]:
+    """
+    Add the time of the block to phase `name` of current request, does nothing outside TimingMiddleware.
+    """
+    timing = _current_timing.get()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - start)
+
+
+def _before_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any,
+                           executemany: bool) -> None:
+    conn.info.setdefault("yodo1_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any,
+                          executemany: bool) -> None:
+    starts = conn.info.get("yodo1_query_start")
+    if not starts:
+        return
+    start = starts.pop()
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.add("db", time.perf_counter() - start)
+
+
+def _on_connect(dbapi_connection: Any, connection_record: Any) -> None:
+    timing = _current_timing.get()
+    if timing is not None:
+        # The pool sets `starttime` right before it opens the DBAPI connection
+        timing.add("db_connect", max(time.time() - connection_record.starttime, 0))
+
+
+def instrument_engine(engine: Any) -> None:
+    """
+    Record the time of opening new DBAPI connections as `db_connect`, and cursor execution time as `db` phases.
+    Checkouts of pooled connections and waits for a free connection of an exhausted pool are not covered.
+    The listeners are kept by the new pool after `engine.dispose()`, calling it again does nothing.
+    """
+    from sqlalchemy import event
+
+    for identifier, listener in [("before_cursor_execute", _before_cursor_execute),
+                                 ("after_cursor_execute", _after_cursor_execute),
+                                 ("connect", _on_connect)]:
+        if not event.contains(engine, identifier, listener):
+            event.listen(engine, identifier, listener)
+
+
+def _timed_endpoint(endpoint: Callable) -> Callable:
+    def finish(timing: Optional[RequestTiming], start: float) -> None:
+        if timing is not None:
+            timing.endpoint_end_at = time.perf_counter()
+            timing.add("endpoint", timing.endpoint_end_at - start)
+
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                finish(_current_timing.get(), start)
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            finish(_current_timing.get(), start)
+    return wrapper
+
+
+class TimedRoute(APIRoute):
+    """
+    APIRoute which records the `endpoint` phase, so TimingMiddleware can break out
+    response validation and serialization as the `serialize` phase.
+
+        app = FastAPI()
+        app.router.route_class = TimedRoute  # before defining routes
+    """
+    def __init__(self, path: str, endpoint: Callable, **kwargs: Any) -> None:
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        """
+        Fixed bucket histogram in milliseconds, percentiles are estimated by the bucket upper bound.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.phases: Dict[str, float] = {}
+
+    def observe(self, ms: float, phases: Dict[str, float]) -> None:
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+        for name, seconds in phases.items():
+            self.phases[name] = self.phases.get(name, 0) + seconds * 1000
+
+    def percentile(self, percent: float) -> float:
+        if self.count == 0:
+            return 0
+        target = self.count * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        count = self.count or 1
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / count, 3),
+            "max_ms": round(self.max, 3),
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "phases_avg_ms": {name: round(total / count, 3) for name, total in self.phases.items()},
+            "buckets": {
+                **{f"le_{bucket:g}": self.counts[index] for index, bucket in enumerate(self.buckets)},
+                "le_inf": self.counts[-1],
+            },
+        }
+
+
+class TimingMetrics:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        """
+        Per route latency histograms, shared between TimingMiddleware and the metrics endpoint.
+        """
+        self.buckets = buckets
+        self._routes: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route: str, ms: float, phases: Dict[str, float]) -> None:
+        with self._lock:
+            histogram = self._routes.get(route)
+            if histogram is None:
+                histogram = self._routes[route] = LatencyHistogram(self.buckets)
+            histogram.observe(ms, phases)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {route: histogram.snapshot() for route, histogram in sorted(self._routes.items())}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes = {}
+
+
+def _route_name(scope: Dict[str, Any]) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return f"{scope.get('method', '')} <unmatched>"
+        path = getattr(endpoint, "__name__", str(endpoint))
+    return f"{scope.get('method', '')} {path}"
+
+
+class TimingMiddleware:
+    def __init__(self,
+                 app: Callable[..., Awaitable[None]],
+                 *,
+                 metrics: Optional[TimingMetrics] = None,
+                 server_timing: bool = True,
+                 profile_every_n: int = 0,
+                 profile_dir: Optional[str] = None,
+                 profile_limit: int = 30) -> None:
+        """
+        ASGI middleware records per route latency and phases (auth, db_connect, db, endpoint, serialize).
+        `db_connect` only covers opening new connections, not waiting for the pool, see `instrument_engine`.
+        :param app: ASGI app
+        :param metrics: TimingMetrics to collect into, expose `metrics.snapshot()` with an endpoint
+        :param server_timing: add `Server-Timing` response header
+        :param profile_every_n: run 1 in N requests under cProfile, 0 to disable.
+                                Only code running on the event loop thread is profiled, not sync endpoints in the threadpool.
+        :param profile_dir: save `.prof` files to this folder, otherwise log the top functions
+        :param profile_limit: function count in the logged profile
+        """
+        self.app = app
+        self.metrics = metrics if metrics is not None else TimingMetrics()
+        self.server_timing = server_timing
+        self.profile_every_n = profile_every_n
+        self.profile_dir = profile_dir
+        self.profile_limit = profile_limit
+        self._request_counter = itertools.count(1)
+        self._profiling = False
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = _current_timing.set(timing)
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                now = time.perf_counter()
+                if timing.endpoint_end_at is not None:
+                    timing.add("serialize", now - timing.endpoint_end_at)
+                timing.add("total", now - timing.start_at)
+                if self.server_timing:
+                    header = ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timing.phases.items())
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+            await send(message)
+
+        profiler = self._start_profiler()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_timing.reset(token)
+            elapsed = time.perf_counter() - timing.start_at
+            phases = {name: seconds for name, seconds in timing.phases.items() if name != "total"}
+            route = _route_name(scope)
+            self.metrics.observe(route, elapsed * 1000, phases)
+            if profiler is not None:
+                self._stop_profiler(profiler, route)
+
+    def _start_profiler(self) -> Optional[cProfile.Profile]:
+        if not self.profile_every_n or next(self._request_counter) % self.profile_every_n:
+            return None
+        # Only one profiler can run at the same time
+        if self._profiling:
+            return None
+        self._profiling = True
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            self._profiling = False
+            return None
+        return profiler
+
+    def _stop_profiler(self, profiler: cProfile.Profile, route: str) -> None:
+        profiler.disable()
+        self._profiling = False
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            file_name = "".join(c if c.isalnum() else "_" for c in route).strip("_")
+            path = os.path.join(self.profile_dir, f"{file_name}-{int(time.time() * 1000)}.prof")
+            profiler.dump_stats(path)
+            logger.info(f"Profile of {route} saved to {path}")
+        else:
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(self.profile_limit)
+            logger.info(f"Profile of {route}\n{output.getvalue()}")
+
+
+__all__ = [
+    'RequestTiming',
+    'TimedRoute',
+    'TimingMetrics',
+    'TimingMiddleware',
+    'current_timing',
+    'instrument_engine',
+    'timing_phase',
+]
@@ -1,21 +1,100 @@
+import atexit
+import itertools
 import logging
+import logging.handlers
+from typing import Dict, Iterable, Iterator, Optional, Tuple, Union
 
+from yodo1.logger import NonBlockingQueueHandler
+
+
+class AccessLogFilter(logging.Filter):
+    def __init__(self,
+                 excluded_paths: Iterable[str] = ('/health_check',),
+                 status_sampling: Optional[Dict[Union[int, str], int]] = None) -> None:
+        """
+        Filter for `uvicorn.access` logger, reads path and status from `record.args` without formatting the message.
+        :param excluded_paths: paths never logged, query string is ignored
+        :param status_sampling: keep 1 in N lines by status code or status class,
+                                like `{200: 100, "3xx": 10}`. Status not in it is always logged.
+        """
+        super().__init__()
+        self.excluded_paths = frozenset(excluded_paths)
+        self.status_sampling: Dict[Union[int, str], int] = dict(status_sampling or {})
+        # Resolve sampling for every status code once, (every_n, counter) or None
+        self._sampling: Dict[int, Optional[Tuple[int, Iterator[int]]]] = {}
+        counters = {key: (every_n, itertools.count()) for key, every_n in self.status_sampling.items()}
+        for status_code in range(100, 600):
+            self._sampling[status_code] = counters.get(status_code) or counters.get(f'{status_code // 100}xx')
 
-class HealthCheckFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
-        return 'GET /health_check' not in record.getMessage()
+        # uvicorn access log args: (client_addr, method, full_path, http_version, status_code)
+        args = record.args
+        if type(args) is tuple and len(args) == 5:
+            path: str = args[2]  # type: ignore
+            if path in self.excluded_paths:
+                return False
+            if '?' in path and path.partition('?')[0] in self.excluded_paths:
+                return False
+            if self.status_sampling:
+                sampling = self._sampling.get(args[4])  # type: ignore
+                if sampling is not None:
+                    return next(sampling[1]) % sampling[0] == 0
+            return True
+        # Unknown record layout, fallback to formatted message
+        message = record.getMessage()
+        return not any(f' {path} ' in message for path in self.excluded_paths)
+
+
+class HealthCheckFilter(AccessLogFilter):
+    def __init__(self) -> None:
+        super().__init__(excluded_paths=('/health_check',))
+
+
+_access_log_listener: Optional[logging.handlers.QueueListener] = None
 
 
-def patch_uvicorn_logger() -> None:
+def _stop_access_log_listener() -> None:
+    global _access_log_listener
+    if _access_log_listener is not None:
+        _access_log_listener.stop()
+        _access_log_listener = None
+
+
+atexit.register(_stop_access_log_listener)
+
+
+def patch_uvicorn_logger(excluded_paths: Iterable[str] = ('/health_check',),
+                         status_sampling: Optional[Dict[Union[int, str], int]] = None,
+                         *,
+                         use_queue: bool = False,
+                         queue_size: int = 10000,
+                         drop_policy: str = 'drop_new') -> None:
     """
     Need to call this at @app.on_event("startup"), otherwise overwrite won't affect
+    :param excluded_paths: paths never logged
+    :param status_sampling: keep 1 in N access lines by status, see `AccessLogFilter`
+    :param use_queue: write access logs on a background thread, see `yodo1.logger.NonBlockingQueueHandler`
+    :param queue_size: max records waiting in the queue
+    :param drop_policy: `drop_new`, `drop_old` or `block` when queue is full
     :return:
     """
+    global _access_log_listener
     uvicorn_logger = logging.getLogger('uvicorn.access')
     if uvicorn_logger:
-        for h in uvicorn_logger.handlers:
+        for h in uvicorn_logger.handlers[:]:
             uvicorn_logger.removeHandler(h)
-        uvicorn_logger.addFilter(HealthCheckFilter())
+        for f in uvicorn_logger.filters[:]:
+            if isinstance(f, AccessLogFilter):
+                uvicorn_logger.removeFilter(f)
+        _stop_access_log_listener()
+
+        uvicorn_logger.addFilter(AccessLogFilter(excluded_paths=excluded_paths, status_sampling=status_sampling))
         handler = logging.StreamHandler()
         handler.setFormatter(logging.Formatter("%(levelname)-5s | %(message)s"))
-        uvicorn_logger.addHandler(handler)
+        if use_queue:
+            queue_handler = NonBlockingQueueHandler(queue_size=queue_size, drop_policy=drop_policy)
+            _access_log_listener = logging.handlers.QueueListener(queue_handler.log_queue, handler)
+            _access_log_listener.start()
+            uvicorn_logger.addHandler(queue_handler)
+        else:
+            uvicorn_logger.addHandler(handler)